@@ -1,20 +1,19 @@
 
 # stdlib Imports
-import base64
-import json
 import logging
+import time
 
-from Products.ZenUtils.Utils import prepId
-from ZenPacks.community.Bamboo.lib.utils import SkipCertifContextFactory
+from Products.DataCollector.plugins.DataMaps import ObjectMap
+from ZenPacks.community.Bamboo.lib.client import CircuitOpen
+from ZenPacks.community.Bamboo.lib.state import state_for
+from ZenPacks.community.Bamboo.lib.task import prepare_task
+from ZenPacks.community.Bamboo.lib.utils import bamboo_server, component_id, server_params
 
 # Zenoss imports
 from ZenPacks.zenoss.PythonCollector.datasources.PythonDataSource import PythonDataSourcePlugin
 
 # Twisted Imports
-from twisted.internet import reactor
 from twisted.internet.defer import inlineCallbacks, returnValue
-from twisted.web.client import Agent, readBody
-from twisted.web.http_headers import Headers
 
 # Setup logging
 log = logging.getLogger('zen.PythonBambooServer')
@@ -27,75 +26,119 @@ class BambooServer(PythonDataSourcePlugin):
         'zBambooUsername',
         'zBambooPassword',
         'zBambooServerAlias',
+        'zBambooRequestTimeout',
+        'zBambooInfoCacheTTL',
+        'zBambooRateLimit',
+        'zBambooBreakerThreshold',
+        'zBambooBreakerCooldown',
+        'zBambooSnapshotMaxSize',
+        'zBambooMaxConcurrentRequests',
+        'zBambooPhaseSpread',
     )
 
     # TODO: /status
     urls = {
-        'bamboo_info': 'https://{}:{}/rest/api/latest/info',
-        'bamboo_queue': 'https://{}:{}/rest/api/latest/queue',
+        'bamboo_info': '/info',
+        'bamboo_queue': '/queue?expand=queuedBuilds',
+        'bamboo_agents': '/agent',
+    }
+    # Datasources served by the response of another one
+    shared = {
+        'bamboo_agent': 'bamboo_agents',
+        'bamboo_project_queue': 'bamboo_queue',
+        'bamboo_plan_queue': 'bamboo_queue',
     }
 
-    # TODO: check config_key broker
     @classmethod
     def config_key(cls, datasource, context):
-        log.debug('In config_key {} {} {} {}'.format(context.device().id, datasource.getCycleTime(context),
-                                                     context.id, 'bamboo'))
+        # The server, agent and queue datasources of a Bamboo server are collected by a single task
+        server_id = bamboo_server(context).id
+        log.debug('In config_key %s %s %s %s', context.device().id, datasource.getCycleTime(context), 'bamboo',
+                  server_id)
         return (
             context.device().id,
             datasource.getCycleTime(context),
-            context.id,
-            'bamboo'
+            'bamboo',
+            server_id
         )
 
     @classmethod
     def params(cls, datasource, context):
         log.debug('Starting BambooServer params')
-        log.debug('params is {}'.format(params))
+        params = {}
+        params['agent_id'] = getattr(context, 'agent_id', None)
+        params['project_key'] = getattr(context, 'project_key', None)
+        params['plan_key'] = getattr(context, 'plan_key', None)
+        params.update(server_params(context))
+        log.debug('params is %s', params)
         return params
 
+    @staticmethod
+    def agent_state(agent):
+        if not agent.get('enabled', True):
+            return 'Disabled'
+        if not agent.get('active', True):
+            return 'Offline'
+        if agent.get('busy'):
+            return 'Busy'
+        return 'Idle'
+
+    @staticmethod
+    def current_job(agent):
+        job = agent.get('currentJob')
+        if isinstance(job, dict):
+            job = job.get('buildResultKey') or job.get('key')
+        return job or ''
+
     @inlineCallbacks
     def collect(self, config):
         log.debug('Starting Bamboo collect')
 
-        ds0 = config.datasources[0]
-        if not ds0.zBambooServerAlias:
-            log.error("%s: zBambooServerAlias cannot be empty", device.id)
+        # The datasources are skipped one by one while the circuit breaker is open, its state is reported
+        task = yield prepare_task(config, 'bamboo', skip_open=False)
+        if task is None:
             returnValue(None)
-
-        basic_auth = base64.encodestring('{}:{}'.format(ds0.zBambooUsername, ds0.zBambooPassword))
-        auth_header = "Basic " + basic_auth.strip()
-        headers = {
-                      "Accept": ["application/json"],
-                      "Authorization": [auth_header],
-                      "User-Agent": ["Mozilla/3.0Gold"],
-                  }
-
-        # deferreds = []
-        # sem = DeferredSemaphore(1)
+        client, _, semaphore = task
         results = {}
-        agent = Agent(reactor, contextFactory=SkipCertifContextFactory())
         for datasource in config.datasources:
-            url = self.urls[datasource.datasource].format(datasource.zBambooServerAlias, datasource.zBambooPort)
+            name = self.shared.get(datasource.datasource, datasource.datasource)
+            if name not in self.urls or name in results:
+                continue
+            if client.breaker.is_open():
+                log.debug('{}: circuit breaker of {} is open, {} skipped'.format(config.id, client.breaker.name, name))
+                continue
+            url = self.urls[name]
             try:
-                response = yield agent.request('GET', url, Headers(headers))
-                response_body = yield readBody(response)
-                response_body = json.loads(response_body)
-                results[datasource.datasource] = response_body
+                if datasource.datasource == 'bamboo_info':
+                    # /info hardly ever changes
+                    response_body, _ = yield semaphore.run(client.get_json_cached, url,
+                                                           datasource.zBambooInfoCacheTTL or 0)
+                else:
+                    response_body = yield semaphore.run(client.get_json, url)
+                results[name] = response_body
 
+            except CircuitOpen as e:
+                log.debug('{}: {}'.format(config.id, e))
             except Exception as e:
-                log.exception('{}: failed to get server data for {}'.format(config.id, ds0))
+                log.exception('{}: failed to get server data for {}'.format(config.id, name))
                 log.exception('{}: Exception: {}'.format(config.id, e))
+
+        # Cost of all the Bamboo collectors since the previous cycle
+        if any(datasource.datasource == 'bamboo_collector' for datasource in config.datasources):
+            results['bamboo_collector'] = client.stats.report()
+        results['breaker'] = {'name': client.breaker.name, 'open': client.breaker.is_open(),
+                              'failures': client.breaker.failures, 'remaining': client.breaker.remaining()}
         returnValue(results)
 
     def onSuccess(self, result, config):
-        log.debug('Success - result is {}'.format(result))
+        log.debug('Success - result is %s', result)
 
-        # TODO: Move following block under next loop, in case of multiple brokers
         data = self.new_data()
-        broker_name = config.datasources[0].component
-        component = prepId(broker_name)
-        ds_data = {}
-        # TODO: fill in data in a single loop, instead of 2 loops
+        # Agent and queue datasources are bound to the agent, project and plan components, the other ones to the
+        # server
+        broker_name = next((ds.component for ds in config.datasources if ds.datasource not in self.shared),
+                           config.datasources[0].component)
+        component = component_id(broker_name)
 
         # Generate metrics data per datasource
         if 'bamboo_info' in result:
@@ -105,7 +148,7 @@ class BambooServer(PythonDataSourcePlugin):
                 msg = '{} - Status is OK'.format(component)
             else:
                 value = 5
-                msg = '{} - Status is {}'.format(component, ds_data[datasource.datasource]['state'])
+                msg = '{} - Status is {}'.format(component, info_data['state'])
 
             data['values'][component]['status'] = value
             data['events'].append({
@@ -119,11 +162,119 @@ class BambooServer(PythonDataSourcePlugin):
                 'eventClass': '/Status/Bamboo',
             })
         if 'bamboo_queue' in result:
-            data['values'][component]['build_queue_length'] = result['bamboo_queue']['queuedBuilds']['size']
+            queue_length = result['bamboo_queue']['queuedBuilds']['size']
+            data['values'][component]['build_queue_length'] = queue_length
+            # A filling queue brings the adaptive polling of build results back to its shortest interval
+            state = state_for(config)
+            if queue_length and not state.queue_length:
+                state.schedule.wake()
+            state.queue_length = queue_length
+            self.queue_data(result['bamboo_queue'], component, config, data)
+
+        if 'bamboo_agents' in result:
+            self.agents_data(result['bamboo_agents'], component, config, data)
 
-        log.debug('BambooServer onSuccess data: {}'.format(data))
+        if 'bamboo_collector' in result:
+            data['values'][component].update(result['bamboo_collector'])
+
+        # A single event while the Bamboo server is left alone, cleared once it answers again
+        if 'breaker' in result:
+            breaker = result['breaker']
+            if breaker['open']:
+                severity = 4
+                msg = '{} - Collection suspended for {:.0f}s after {} consecutive failures of {}'.format(
+                    component, breaker['remaining'], breaker['failures'], breaker['name'])
+            else:
+                severity = 0
+                msg = '{} - Collection is running'.format(component)
+            data['events'].append({
+                'device': config.id,
+                'component': component,
+                'severity': severity,
+                'eventKey': 'BambooCircuitBreaker',
+                'eventClassKey': 'BambooCircuitBreaker',
+                'summary': msg,
+                'message': msg,
+                'eventClass': '/Status/Bamboo',
+            })
+
+        log.debug('BambooServer onSuccess data: %s', data)
         return data
 
+    def queue_data(self, queue, component, config, data):
+        """
+        Fill in the number of queued builds and the wait of the oldest one, for the server and for each project and
+        plan. Bamboo doesn't tell when a build was queued, the wait is counted from the first cycle it was seen in.
+        """
+        now = time.time()
+        state = state_for(config)
+        queued = {}
+        for build in queue['queuedBuilds'].get('queuedBuild', []):
+            key = build.get('buildResultKey')
+            if not key:
+                continue
+            queued[key] = build
+        queued_since = dict((key, state.queued_since.get(key, now)) for key in queued)
+        if queued_since != state.queued_since:
+            state.queued_since = queued_since
+            state.dirty = True
+
+        plans = {}
+        projects = {}
+        for key, build in queued.items():
+            plan_key = build.get('planKey') or key.rsplit('-', 1)[0]
+            wait = now - state.queued_since[key]
+            for counts, counts_key in ((plans, plan_key), (projects, plan_key.split('-', 1)[0])):
+                count, oldest = counts.get(counts_key, (0, 0))
+                counts[counts_key] = (count + 1, max(oldest, wait))
+        data['values'][component]['oldest_wait'] = max([now - since for since in state.queued_since.values()] or [0])
+
+        for datasource in config.datasources:
+            if datasource.datasource == 'bamboo_project_queue':
+                count, oldest = projects.get(datasource.params.get('project_key'), (0, 0))
+            elif datasource.datasource == 'bamboo_plan_queue':
+                count, oldest = plans.get(datasource.params.get('plan_key'), (0, 0))
+            else:
+                continue
+            data['values'][datasource.component]['queued_builds'] = count
+            data['values'][datasource.component]['queue_wait'] = oldest
+
+    def agents_data(self, agents, component, config, data):
+        """
+        Fill in the utilization of the agents of the server, and the values of each agent. The state and current job
+        of the agent components are only updated when they change.
+        """
+        online = [agent for agent in agents if agent.get('enabled', True) and agent.get('active', True)]
+        busy = sum(1 for agent in online if agent.get('busy'))
+        # Running builds keep the adaptive polling of build results at its shortest interval, like a filling queue
+        state = state_for(config)
+        if busy and not state.running_builds:
+            state.schedule.wake()
+        state.running_builds = busy
+        data['values'][component]['agents_online'] = len(online)
+        data['values'][component]['agents_busy'] = busy
+        if online:
+            data['values'][component]['agent_utilization'] = 100.0 * busy / len(online)
+
+        agents = dict((str(agent['id']), agent) for agent in agents)
+        sent = state.agent_states
+        for datasource in config.datasources:
+            agent = agents.get(str(datasource.params.get('agent_id')))
+            if datasource.datasource != 'bamboo_agent' or agent is None:
+                continue
+            agent_state = self.agent_state(agent)
+            data['values'][datasource.component]['busy'] = 1 if agent_state == 'Busy' else 0
+            data['values'][datasource.component]['online'] = 1 if agent_state in ('Busy', 'Idle') else 0
+            status = (agent_state, self.current_job(agent))
+            if sent.get(datasource.component) != status:
+                sent[datasource.component] = status
+                data['maps'].append(ObjectMap({
+                    'compname': 'bambooServers/{}/bambooAgents/{}'.format(component, datasource.component),
+                    'modname': 'ZenPacks.community.Bamboo.BambooAgent',
+                    'state': status[0],
+                    'current_job': status[1],
+                }))
+
     def onError(self, result, config):
         log.error('Error - result is {}'.format(result))
         # TODO: send event of collection failure
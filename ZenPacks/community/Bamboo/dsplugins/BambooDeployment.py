@@ -0,0 +1,189 @@
+
+# stdlib Imports
+import logging
+import time
+
+from ZenPacks.community.Bamboo.lib.client import CircuitOpen, client_for
+from ZenPacks.community.Bamboo.lib.state import state_for
+from ZenPacks.community.Bamboo.lib.task import prepare_task
+from ZenPacks.community.Bamboo.lib.utils import bamboo_server, server_address, server_params
+
+# Zenoss imports
+from ZenPacks.zenoss.PythonCollector.datasources.PythonDataSource import PythonDataSourcePlugin
+
+# Twisted Imports
+from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
+
+# Setup logging
+log = logging.getLogger('zen.PythonBambooDeployment')
+
+
+class BambooDeployment(PythonDataSourcePlugin):
+    """
+    Batched collection of the deployments of all the environments of a Bamboo server.
+
+    The latest deployment of every environment is read from a single /deploy/dashboard request per cycle. Its
+    duration is reported once, with its completion time, and its state at every cycle: 0 when successful, 4 when it
+    failed, 2 otherwise. The time since the last successful deployment is kept per environment. When the latest
+    deployment of an environment isn't successful and no release is known yet, its recent results are read once.
+    """
+
+    proxy_attributes = (
+        'zBambooPort',
+        'zBambooUsername',
+        'zBambooPassword',
+        'zBambooServerAlias',
+        'zBambooRequestTimeout',
+        'zBambooMaxConcurrentRequests',
+        'zBambooRateLimit',
+        'zBambooBreakerThreshold',
+        'zBambooBreakerCooldown',
+        'zBambooSnapshotMaxSize',
+        'zBambooPhaseSpread',
+    )
+
+    dashboard_url = '/deploy/dashboard'
+    environment_results_url = '/deploy/environment/{}/results?max-result={}'
+    # Number of results read back to find the last successful deployment of an environment
+    max_history = 25
+
+    @classmethod
+    def config_key(cls, datasource, context):
+        server_id = bamboo_server(context).id
+        log.debug('In config_key %s %s %s %s', context.device().id, datasource.getCycleTime(context),
+                  'bambooDeployment', server_id)
+        return (
+            context.device().id,
+            datasource.getCycleTime(context),
+            'bambooDeployment',
+            server_id
+        )
+
+    @classmethod
+    def params(cls, datasource, context):
+        params = {}
+        params['environment_id'] = context.environment_id
+        params['deployment_id'] = context.deployment_id
+        params.update(server_params(context))
+        log.debug('params is %s', params)
+        return params
+
+    @staticmethod
+    def deployment_state(deployment):
+        state = deployment.get('deploymentState')
+        if state == 'SUCCESS':
+            return 0
+        if state == 'FAILED':
+            return 4
+        return 2
+
+    @staticmethod
+    def finished(deployment):
+        """
+        Return the completion time of a deployment result, in seconds, or None while it is running.
+        """
+        if deployment.get('lifeCycleState', 'FINISHED') != 'FINISHED' or not deployment.get('finishedDate'):
+            return None
+        return deployment['finishedDate'] / 1000.0
+
+    @inlineCallbacks
+    def collect(self, config):
+        log.debug('Starting Bamboo deployment collect')
+
+        task = yield prepare_task(config, 'bambooDeployment')
+        if task is None:
+            returnValue({})
+        client, state, semaphore = task
+
+        try:
+            dashboard = yield semaphore.run(client.get_json, self.dashboard_url)
+        except CircuitOpen as e:
+            log.debug('{}: {}'.format(config.id, e))
+            returnValue({})
+        except Exception as e:
+            log.error('{}: failed to get the deployment dashboard: {}'.format(config.id, e))
+            returnValue({})
+
+        environment_ids = set(str(ds.params.get('environment_id')) for ds in config.datasources)
+        deployments = {}
+        for deployment_project in dashboard:
+            for status in deployment_project.get('environmentStatuses') or []:
+                environment_id = str(status['environment']['id'])
+                if environment_id in environment_ids and status.get('deploymentResult'):
+                    deployments[environment_id] = status['deploymentResult']
+
+        # Last successful deployment of the environments that failed since the collector started
+        missing = [environment_id for environment_id, deployment in deployments.items()
+                   if deployment.get('deploymentState') != 'SUCCESS' and environment_id not in state.last_release]
+        deferreds = [semaphore.run(client.get_json, self.environment_results_url.format(environment_id,
+                                                                                        self.max_history))
+                     for environment_id in missing]
+        history = yield DeferredList(deferreds, consumeErrors=True)
+        for environment_id, (success, response_body) in zip(missing, history):
+            if not success:
+                if not response_body.check(CircuitOpen):
+                    log.error('{}: failed to get the deployments of environment {}: {}'.format(
+                        config.id, environment_id, response_body.getErrorMessage()))
+                continue
+            releases = [self.finished(d) for d in response_body.get('results') or []
+                        if d.get('deploymentState') == 'SUCCESS']
+            state.last_release[environment_id] = max([r for r in releases if r] or [0])
+            state.dirty = True
+
+        returnValue({'deployments': deployments})
+
+    def onSuccess(self, result, config):
+        data = self.new_data()
+        if not result or 'deployments' not in result:
+            return data
+
+        state = state_for(config)
+        now = time.time()
+        for datasource in config.datasources:
+            environment_id = str(datasource.params.get('environment_id'))
+            deployment = result['deployments'].get(environment_id)
+            if deployment is None:
+                continue
+            values = data['values'][datasource.component]
+            severity = self.deployment_state(deployment)
+            values['state'] = severity
+
+            finished = self.finished(deployment)
+            if finished and deployment.get('deploymentState') == 'SUCCESS':
+                if finished > state.last_release.get(environment_id, 0):
+                    state.last_release[environment_id] = finished
+                    state.dirty = True
+            if state.last_release.get(environment_id):
+                values['time_since_release'] = max(now - state.last_release[environment_id], 0)
+
+            # Each deployment is reported once, when it completes
+            if finished is None or state.deployments.get(environment_id) == deployment.get('id'):
+                continue
+            state.deployments[environment_id] = deployment.get('id')
+            state.dirty = True
+            started = deployment.get('executedDate') or deployment.get('startedDate')
+            if started:
+                values['duration'] = (max(finished - started / 1000.0, 0), finished)
+
+            msg = '{} - Deployment of {} is {}'.format(datasource.component, deployment.get('deploymentVersionName'),
+                                                       deployment.get('deploymentState'))
+            data['events'].append({
+                'device': config.id,
+                'component': datasource.component,
+                'severity': 0 if severity == 0 else 4,
+                'eventKey': 'BambooDeploymentState',
+                'eventClassKey': 'BambooDeploymentState',
+                'summary': msg,
+                'message': msg,
+                'eventClass': '/Status/Bamboo',
+            })
+
+        ds0 = config.datasources[0]
+        client_for(ds0, server_address(ds0)).stats.record_components(len(data['values']))
+
+        log.debug('BambooDeployment onSuccess data: %s', data)
+        return data
+
+    def onError(self, result, config):
+        log.error('Error - result is {}'.format(result))
+        return {}
@@ -0,0 +1,136 @@
+
+# stdlib Imports
+import logging
+import time
+
+from ZenPacks.community.Bamboo.lib.client import CircuitOpen, client_for
+from ZenPacks.community.Bamboo.lib.state import state_for
+from ZenPacks.community.Bamboo.lib.task import prepare_task
+from ZenPacks.community.Bamboo.lib.utils import bamboo_server, parse_bamboo_time, server_address, server_params
+
+# Zenoss imports
+from ZenPacks.zenoss.PythonCollector.datasources.PythonDataSource import PythonDataSourcePlugin
+
+# Twisted Imports
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+# Setup logging
+log = logging.getLogger('zen.PythonBambooPlanStatus')
+
+
+class BambooPlanStatus(PythonDataSourcePlugin):
+    """
+    Batched collection of the status of all the plans of a Bamboo server.
+
+    Only the paged /plan listing is read at each cycle, for whether each plan is building. The latest build of each
+    plan is the one last seen by the BambooProject task of the same server, from its /result listing or from the
+    notifications, so that the listing isn't read twice. Reported for each plan: the state of its latest build (0
+    when successful, 4 when it failed, 2 otherwise), whether it is building and the seconds since its latest build
+    completed.
+    """
+
+    proxy_attributes = (
+        'zBambooPort',
+        'zBambooUsername',
+        'zBambooPassword',
+        'zBambooServerAlias',
+        'zBambooRequestTimeout',
+        'zBambooPageSize',
+        'zBambooMaxConcurrentRequests',
+        'zBambooRateLimit',
+        'zBambooBreakerThreshold',
+        'zBambooBreakerCooldown',
+        'zBambooPhaseSpread',
+        'zBambooSnapshotMaxSize',
+    )
+
+    plans_url = '/plan?expand=plans.plan'
+    # Attributes kept from the entries of the listing
+    fields = ('key', 'isBuilding')
+
+    @classmethod
+    def config_key(cls, datasource, context):
+        server_id = bamboo_server(context).id
+        log.debug('In config_key %s %s %s %s', context.device().id, datasource.getCycleTime(context),
+                  'bambooPlanStatus', server_id)
+        return (
+            context.device().id,
+            datasource.getCycleTime(context),
+            'bambooPlanStatus',
+            server_id
+        )
+
+    @classmethod
+    def params(cls, datasource, context):
+        params = {}
+        params['plan_key'] = context.plan_key
+        params.update(server_params(context))
+        log.debug('params is %s', params)
+        return params
+
+    @staticmethod
+    def build_state(build):
+        state = build.get('buildState')
+        if state == 'Successful':
+            return 0
+        if state == 'Failed':
+            return 4
+        return 2
+
+    @inlineCallbacks
+    def collect(self, config):
+        log.debug('Starting Bamboo plan status collect')
+
+        # The latest builds of the plans are restored with the high-water marks
+        task = yield prepare_task(config, 'bambooPlanStatus')
+        if task is None:
+            returnValue(None)
+        client, _, semaphore = task
+        ds0 = config.datasources[0]
+
+        # Entries of the plans that aren't monitored are dropped as the listing is parsed
+        plan_keys = set(ds.params.get('plan_key') for ds in config.datasources)
+        try:
+            plans = yield client.get_paged(self.plans_url, 'plans', ds0.zBambooPageSize or 25, semaphore, self.fields,
+                                           lambda entry: entry.get('key') in plan_keys)
+        except CircuitOpen as e:
+            log.debug('{}: {}'.format(config.id, e))
+            plans = None
+        except Exception as e:
+            log.error('{}: failed to get the plans listing: {}'.format(config.id, e))
+            plans = None
+        results = {}
+        if plans is not None:
+            results['plans'] = dict((plan['key'], plan) for plan in plans)
+        returnValue(results)
+
+    def onSuccess(self, result, config):
+        data = self.new_data()
+        if result is None:
+            return data
+
+        now = time.time()
+        plans = result.get('plans', {})
+        builds = state_for(config).latest_builds
+        for datasource in config.datasources:
+            plan_key = datasource.params.get('plan_key')
+            plan = plans.get(plan_key)
+            if plan is not None:
+                data['values'][datasource.component]['building'] = 1 if plan.get('isBuilding') else 0
+            build = builds.get(plan_key)
+            if build is None:
+                continue
+            data['values'][datasource.component]['state'] = self.build_state(build)
+            completed = parse_bamboo_time(build.get('buildCompletedTime'))
+            if completed:
+                data['values'][datasource.component]['last_build_age'] = max(now - completed, 0)
+
+        ds0 = config.datasources[0]
+        client_for(ds0, server_address(ds0)).stats.record_components(len(data['values']))
+
+        log.debug('BambooPlanStatus onSuccess data: %s', data)
+        return data
+
+    def onError(self, result, config):
+        log.error('Error - result is {}'.format(result))
+        return {}
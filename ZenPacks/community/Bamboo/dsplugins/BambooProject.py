@@ -1,53 +1,103 @@
 
 # stdlib Imports
-import base64
-import json
 import logging
+import time
 
-from Products.ZenUtils.Utils import prepId
-from ZenPacks.community.Bamboo.lib.utils import SkipCertifContextFactory
+from ZenPacks.community.Bamboo.lib.client import CircuitOpen, client_for
+from ZenPacks.community.Bamboo.lib.snapshot import save_snapshot
+from ZenPacks.community.Bamboo.lib.state import state_for
+from ZenPacks.community.Bamboo.lib.stats import build_metrics
+from ZenPacks.community.Bamboo.lib.task import prepare_task
+from ZenPacks.community.Bamboo.lib.utils import (BoundedMemo, bamboo_server, parse_bamboo_time, server_address,
+                                                 server_params)
+from ZenPacks.community.Bamboo.lib.webhook import start_listener
 
 # Zenoss imports
 from ZenPacks.zenoss.PythonCollector.datasources.PythonDataSource import PythonDataSourcePlugin
-from Products.ZenUtils.Utils import prepId
 
 # Twisted Imports
-from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, returnValue
-from twisted.web.client import Agent, readBody
-from twisted.web.http_headers import Headers
+from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
 
 # Setup logging
 log = logging.getLogger('zen.PythonBambooProject')
 
 
 class BambooProject(PythonDataSourcePlugin):
+    """
+    Batched collection of the build results of all the projects and plans of a Bamboo server.
+
+    All the BambooProject and BambooPlan datasources of a Bamboo server share the same config_key, so that they are
+    collected by a single task per server. The latest results of all plans are read through the paged /result listing
+    and the values are then dispatched to each component.
+
+    The number of the last build processed for each plan is kept as a high-water mark: only newer builds are reported,
+    each one once and with its completion time. When several builds completed since the previous cycle, the missing
+    ones are read from the results of that plan, for at most max_backfill plans per cycle. The other plans are read
+    back at the next cycles, and their builds are reported then, so that a restart after a long downtime doesn't send
+    a request per plan at once.
+
+    When zBambooWebhookPort is set, the builds notified by Bamboo are reported at the next cycle, and the /result
+    listing is only polled every zBambooWebhookPollInterval seconds to catch up on lost notifications. The listener
+    binds zBambooWebhookInterface, localhost by default, and requires zBambooWebhookToken when it is set.
+
+    With zBambooAdaptivePolling, the listing is polled every zBambooMinInterval seconds while builds are queued,
+    running or completing, and the interval doubles at each idle cycle up to zBambooMaxInterval. Queued and running
+    builds are counted by the BambooServer task, from /queue and from the busy agents. The task itself still runs at
+    the cycle time of the datasources, which is then the shortest effective interval.
+
+    The last BUILD_WINDOW builds of each plan are kept to report the p50/p90/max build duration, the queue wait
+    (queueStartedTime to buildStartedTime), the success ratio and the number of builds completed in the last hour.
+    """
 
     proxy_attributes = (
         'zBambooPort',
         'zBambooUsername',
         'zBambooPassword',
         'zBambooServerAlias',
+        'zBambooRequestTimeout',
+        'zBambooPageSize',
+        'zBambooMaxConcurrentRequests',
+        'zBambooWebhookPort',
+        'zBambooWebhookInterface',
+        'zBambooWebhookToken',
+        'zBambooWebhookPollInterval',
+        'zBambooAdaptivePolling',
+        'zBambooMinInterval',
+        'zBambooMaxInterval',
+        'zBambooRateLimit',
+        'zBambooBreakerThreshold',
+        'zBambooBreakerCooldown',
+        'zBambooSnapshotMaxSize',
+        'zBambooPhaseSpread',
+        'zBambooAnomalyZScore',
     )
 
-    # TODO: /status
-    urls = {
-        'bamboo_info': 'https://{}:{}/rest/api/latest/info',
-        'bamboo_queue': 'https://{}:{}/rest/api/latest/queue',
-    }
+    results_url = '/result?expand=results.result'
+    plan_results_url = '/result/{}?expand=results.result&max-result={}'
+    # Maximum number of missed builds read back for a single plan
+    max_history = 100
+    # Maximum number of plans whose missed builds are read back in a cycle
+    max_backfill = 50
+    # Cycles without any notification after which the /result listing is polled normally again
+    webhook_stale_cycles = 2
+    # Attributes kept from the build results
+    fields = ('buildNumber', 'buildDuration', 'buildState', 'lifeCycleState', 'buildCompletedTime', 'buildStartedTime',
+              'queueStartedTime', 'plan.key')
+    # Attributes of the latest build of each plan kept in the DeviceState
+    latest_fields = ('buildNumber', 'buildState', 'buildCompletedTime')
+    # Datapoint of each metric of build_metrics
+    metric_datapoint = BoundedMemo('bamboo_build_plan_{}'.format)
 
-    # TODO: check config_key broker
     @classmethod
     def config_key(cls, datasource, context):
-        log.debug('In config_key {} {} {} {}'.format(context.device().id,
-                                                     datasource.getCycleTime(context),
-                                                     context.id,
-                                                     'bambooPlan'))
+        server_id = bamboo_server(context).id
+        log.debug('In config_key %s %s %s %s', context.device().id, datasource.getCycleTime(context), 'bambooResults',
+                  server_id)
         return (
             context.device().id,
             datasource.getCycleTime(context),
-            context.id,
-            'bambooPlan'
+            'bambooResults',
+            server_id
         )
 
     @classmethod
@@ -55,77 +105,222 @@ class BambooProject(PythonDataSourcePlugin):
         log.debug('Starting BambooProject params')
         params = {}
         params['project_key'] = context.project_key
-        log.debug('params is {}'.format(params))
+        params['plan_key'] = getattr(context, 'plan_key', None)
+        params.update(server_params(context))
+        log.debug('params is %s', params)
         return params
 
+    @staticmethod
+    def queue_wait(build):
+        """
+        Return the seconds a build waited in the queue before starting, or None when unknown.
+        """
+        queued = parse_bamboo_time(build.get('queueStartedTime'))
+        started = parse_bamboo_time(build.get('buildStartedTime'))
+        if queued is None or started is None:
+            return None
+        return max(started - queued, 0)
+
     @inlineCallbacks
     def collect(self, config):
         log.debug('Starting Bamboo collect')
 
+        task = yield prepare_task(config, 'bambooResults')
+        if task is None:
+            returnValue({})
+        client, state, semaphore = task
         ds0 = config.datasources[0]
-        if not ds0.zBambooServerAlias:
-            log.error("%s: zBambooServerAlias cannot be empty", device.id)
-            returnValue(None)
-
-        basic_auth = base64.encodestring('{}:{}'.format(ds0.zBambooUsername, ds0.zBambooPassword))
-        auth_header = "Basic " + basic_auth.strip()
-        headers = {
-                      "Accept": ["application/json"],
-                      "Authorization": [auth_header],
-                      "User-Agent": ["Mozilla/3.0Gold"],
-                  }
-        base_url = 'https://{}:{}/rest/api/latest/result/{}/?expand=results.result'
         results = {}
-        agent = Agent(reactor, contextFactory=SkipCertifContextFactory())
-
-        url = base_url.format(ds0.zBambooServerAlias, ds0.zBambooPort, ds0.params['project_key'])
-        # Look for size > max-result
-        try:
-            response = yield agent.request('GET', url, Headers(headers))
-            response_body = yield readBody(response)
-            response_body = json.loads(response_body)
-            # results[datasource.datasource] = response_body
-            results = response_body
-        except Exception as e:
-            log.exception('{}: failed to get server data for {}'.format(config.id, ds0))
-            log.exception('{}: Exception: {}'.format(config.id, e))
+        if ds0.zBambooWebhookPort:
+            state.webhook_token = ds0.zBambooWebhookToken
+            start_listener(ds0.zBambooWebhookPort, ds0.zBambooWebhookInterface)
+        candidates = state.pop_webhook_builds()
+
+        # While notifications are received, the /result listing is only polled as a fallback
+        now = time.time()
+        webhook_live = state.last_webhook and now - state.last_webhook < self.webhook_stale_cycles * ds0.cycletime
+        poll = not webhook_live or now - state.last_poll >= ds0.zBambooWebhookPollInterval
+        if ds0.zBambooAdaptivePolling:
+            state.schedule.configure(ds0.zBambooMinInterval, ds0.zBambooMaxInterval)
+            if poll and not state.schedule.due(now):
+                log.debug('{}: next poll of build results in {}s'.format(
+                    config.id, int(state.schedule.last_run + state.schedule.interval - now)))
+                poll = False
+        if poll:
+            try:
+                builds = yield client.get_paged(self.results_url, 'results', ds0.zBambooPageSize or 25, semaphore,
+                                                self.fields)
+                candidates.extend(builds)
+                state.last_poll = now
+            except CircuitOpen as e:
+                log.debug('{}: {}'.format(config.id, e))
+            except Exception as e:
+                log.exception('{}: failed to get server data for {}'.format(config.id, ds0))
+                log.exception('{}: Exception: {}'.format(config.id, e))
+
+        plan_keys = set(ds.params.get('plan_key') for ds in config.datasources)
+        high_water = state.high_water
+        latest_builds = state.latest_builds
+        new_builds = {}
+        for build in candidates:
+            plan_key = build['plan']['key']
+            if plan_key not in plan_keys:
+                continue
+            # Shared with the BambooPlanStatus task, which doesn't read the /result listing again
+            if build.get('lifeCycleState', 'Finished') == 'Finished':
+                latest = latest_builds.get(plan_key)
+                if latest is None or build['buildNumber'] > latest['buildNumber']:
+                    latest_builds[plan_key] = dict((name, build.get(name)) for name in self.latest_fields)
+                    state.dirty = True
+            last_number = high_water.get(plan_key)
+            if last_number is None or build['buildNumber'] > last_number:
+                new_builds.setdefault(plan_key, {})[build['buildNumber']] = build
+
+        for plan_key, builds in new_builds.items():
+            last_number = high_water.get(plan_key)
+            latest_number = max(builds)
+            if last_number is None:
+                # First time the plan is seen, only its latest build is reported
+                new_builds[plan_key] = {latest_number: builds[latest_number]}
+            elif len(builds) < latest_number - last_number:
+                state.backfill[plan_key] = min(latest_number - last_number, self.max_history)
+
+        # Builds that completed between two cycles, before the latest one. Plans left for a later cycle keep their
+        # high-water mark until then.
+        missed = []
+        while state.backfill and len(missed) < self.max_backfill:
+            plan_key, count = state.backfill.popitem(last=False)
+            if plan_key in plan_keys and plan_key in high_water:
+                missed.append((plan_key, count))
+        for plan_key in state.backfill:
+            new_builds.pop(plan_key, None)
+        deferreds = [semaphore.run(client.get_listing, self.plan_results_url.format(plan_key, count), 'results',
+                                   self.fields)
+                     for plan_key, count in missed]
+        history = yield DeferredList(deferreds, consumeErrors=True)
+        for (plan_key, count), (success, response_body) in zip(missed, history):
+            if not success:
+                if response_body.check(CircuitOpen):
+                    # Read back once the server answers again
+                    state.backfill[plan_key] = count
+                    new_builds.pop(plan_key, None)
+                else:
+                    log.error('{}: failed to get results of plan {}: {}'.format(config.id, plan_key,
+                                                                                 response_body.getErrorMessage()))
+                continue
+            for build in response_body['results']['result']:
+                if build['buildNumber'] > high_water[plan_key]:
+                    new_builds.setdefault(plan_key, {}).setdefault(build['buildNumber'], build)
+        if state.backfill:
+            log.info('{}: missed builds of {} plans left for the next cycles'.format(config.id, len(state.backfill)))
+
+        results['builds'] = dict((plan_key, builds.values()) for plan_key, builds in new_builds.items())
+        if ds0.zBambooAdaptivePolling and poll:
+            state.schedule.update(bool(new_builds) or state.queue_length > 0 or state.running_builds > 0, now)
         returnValue(results)
 
     def onSuccess(self, result, config):
-        # log.debug('Success - result is {}'.format(result))
-
         data = self.new_data()
+        if not result or 'builds' not in result:
+            return data
 
-        builds = result['results']
-        log.debug('AAAA max-result:{}'.format(builds['max-result']))
-        log.debug('AAAA size      :{}'.format(builds['size']))
+        state = state_for(config)
+        high_water = state.high_water
+        now = time.time()
+        debug = log.isEnabledFor(logging.DEBUG)
+        # plan_key -> (component, durations of the new builds)
+        new_durations = {}
+        for datasource in config.datasources:
+            plan_key = datasource.params.get('plan_key')
+            builds = result['builds'].get(plan_key)
+            window = state.build_windows.get(plan_key)
+            values = []
+            last_build = None
+            for build in sorted(builds or [], key=lambda b: b['buildNumber']):
+                if build.get('lifeCycleState', 'Finished') != 'Finished':
+                    continue
+                duration = float(build['buildDuration']) / 1000
+                timestamp = parse_bamboo_time(build.get('buildCompletedTime'))
+                if debug:
+                    log.debug('plan: %s - build: %s - duration: %s', plan_key, build['buildNumber'], duration)
+                values.append((duration, timestamp) if timestamp else (duration, 'N'))
+                high_water[plan_key] = build['buildNumber']
+                state.dirty = True
+                last_build = build
+                window = state.add_build(plan_key, timestamp, duration, self.queue_wait(build),
+                                         build.get('buildState') == 'Successful')
 
-        for build in builds['result']:
-            duration = float(build['buildDuration']) / 1000
-            plan_key = build['plan']['key']
-            log.debug('plan: {} - duration: {}'.format(plan_key, duration))
-            component = prepId(plan_key)
-            data['values'][component]['bamboo_build_plan_duration'] = duration
+            # Metrics over the recent builds, until builds_per_hour drops back to 0 after the last one
+            if window and (values or now - (window[-1][0] or 0) < 3600 + datasource.cycletime):
+                component_values = data['values'][datasource.component]
+                for name, value in build_metrics(window, now).items():
+                    component_values[self.metric_datapoint(name)] = value
+            if not values:
+                continue
+            data['values'][datasource.component]['bamboo_build_plan_duration'] = values
+            new_durations[plan_key] = (datasource.component, [value[0] for value in values])
 
-        '''
-            data['values'][component]['status'] = value
+            if last_build.get('buildState') == 'Successful':
+                severity = 0
+            else:
+                severity = 4
+            msg = '{} - Build #{} is {}'.format(plan_key, last_build['buildNumber'], last_build.get('buildState'))
             data['events'].append({
                 'device': config.id,
-                'component': component,
-                'severity': value,
-                'eventKey': 'BambooState',
-                'eventClassKey': 'BambooState',
+                'component': datasource.component,
+                'severity': severity,
+                'eventKey': 'BambooBuildState',
+                'eventClassKey': 'BambooBuildState',
                 'summary': msg,
                 'message': msg,
                 'eventClass': '/Status/Bamboo',
             })
-        if 'bamboo_queue' in result:
-            data['values'][component]['build_queue_length'] = result['bamboo_queue']['queuedBuilds']['size']
-        '''
 
-        log.debug('BambooProject onSuccess data: {}'.format(data))
+        ds0 = config.datasources[0]
+        self.anomaly_data(state, new_durations, ds0.zBambooAnomalyZScore, config, data)
+
+        client = client_for(ds0, server_address(ds0))
+        client.stats.record_components(len(data['values']))
+        # The snapshot holds the state of the other tasks of the server too, it is only saved from here
+        save_snapshot(state, client, 'zenpython', ds0.zBambooSnapshotMaxSize)
+
+        log.debug('BambooProject onSuccess data: %s', data)
         return data
 
+    def anomaly_data(self, state, new_durations, threshold, config, data):
+        """
+        Fill in the z-score and EWMA of the duration of the latest build of each plan, against its recent builds. With
+        a threshold, a build slower than threshold standard deviations above the mean raises an event, cleared by the
+        next build within it.
+        """
+        stats = state.durations.update(dict((plan_key, durations) for plan_key, (_, durations)
+                                            in new_durations.items()))
+        for plan_key, (zscore, ewma, mean, stddev) in stats.items():
+            component, durations = new_durations[plan_key]
+            data['values'][component]['bamboo_build_plan_duration_ewma'] = ewma
+            if zscore is None:
+                continue
+            data['values'][component]['bamboo_build_plan_duration_zscore'] = zscore
+            if not threshold:
+                continue
+            if zscore >= threshold:
+                severity = 3
+                msg = '{} - Build took {:.0f}s, {:.1f} standard deviations above the mean of {:.0f}s'.format(
+                    plan_key, durations[-1], zscore, mean)
+            else:
+                severity = 0
+                msg = '{} - Build duration is usual'.format(plan_key)
+            data['events'].append({
+                'device': config.id,
+                'component': component,
+                'severity': severity,
+                'eventKey': 'BambooBuildDuration',
+                'eventClassKey': 'BambooBuildDuration',
+                'summary': msg,
+                'message': msg,
+                'eventClass': '/Status/Bamboo',
+            })
+
     def onError(self, result, config):
         log.error('Error - result is {}'.format(result))
         # TODO: send event of collection failure
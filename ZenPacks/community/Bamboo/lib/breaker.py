@@ -0,0 +1,132 @@
+
+# stdlib Imports
+import logging
+import time
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.breaker')
+
+
+class TokenBucket(object):
+    """
+    Token-bucket rate limiter. A rate of 0 disables it.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self.tokens = None
+        self.updated = time.time()
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.burst = float(burst or max(self.rate, 1))
+        self.tokens = self.burst if self.tokens is None else min(self.tokens, self.burst)
+
+    def reserve(self, now=None):
+        """
+        Take a token and return the number of seconds to wait before using it.
+        """
+        if not self.rate:
+            return 0
+        now = now or time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class CircuitBreaker(object):
+    """
+    Stop sending requests to a Bamboo server after threshold consecutive failures.
+
+    Once open, the breaker rejects all requests during cooldown seconds. It is then half-open: a single request is
+    let through as a probe, and the others are rejected until its outcome is known. A success closes the breaker, a
+    failure opens it for another cooldown. A threshold of 0 disables the breaker.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold=5, cooldown=300):
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        # Whether the probe of the half-open breaker is in flight
+        self.probing = False
+        self.configure(threshold, cooldown)
+
+    def configure(self, threshold, cooldown):
+        self.threshold = threshold or 0
+        self.cooldown = cooldown or 0
+        if not self.threshold and self.state != self.CLOSED:
+            self.success()
+
+    def is_open(self, now=None):
+        """
+        Whether requests are currently rejected.
+        """
+        if not self.threshold:
+            return False
+        if self.state == self.HALF_OPEN:
+            return self.probing
+        return self.state == self.OPEN and (now or time.time()) - self.opened < self.cooldown
+
+    def allow(self, now=None):
+        """
+        Whether a request can be sent now. Called right before sending it, since the request allowed once the
+        cooldown is over is the probe.
+        """
+        if self.is_open(now):
+            return False
+        if self.state != self.CLOSED:
+            log.info('{}: circuit breaker half-open, trying again'.format(self.name))
+            self.state = self.HALF_OPEN
+            self.probing = True
+        return True
+
+    def success(self):
+        if self.state != self.CLOSED:
+            log.info('{}: circuit breaker closed'.format(self.name))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def failure(self, now=None):
+        self.failures += 1
+        if not self.threshold:
+            return
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+            log.warning('{}: circuit breaker open after {} failures'.format(self.name, self.failures))
+            self.state = self.OPEN
+            self.opened = now or time.time()
+        self.probing = False
+
+    def remaining(self, now=None):
+        """
+        Seconds left before requests are allowed again.
+        """
+        if self.state != self.OPEN:
+            return 0
+        return max(0, self.cooldown - ((now or time.time()) - self.opened))
+
+
+_buckets = {}
+_breakers = {}
+
+
+def get_rate_limiter(host):
+    bucket = _buckets.get(host)
+    if bucket is None:
+        bucket = _buckets[host] = TokenBucket()
+    return bucket
+
+
+def get_breaker(host):
+    breaker = _breakers.get(host)
+    if breaker is None:
+        breaker = _breakers[host] = CircuitBreaker('{}:{}'.format(*host))
+    return breaker
@@ -0,0 +1,62 @@
+
+# stdlib Imports
+import time
+from collections import OrderedDict
+
+
+class CacheEntry(object):
+    """
+    Parsed response body, with the validators needed to revalidate it.
+    """
+
+    __slots__ = ('data', 'digest', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, data, digest=None, etag=None, last_modified=None, expires=0):
+        self.data = data
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def fresh(self, now=None):
+        return (now or time.time()) < self.expires
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = [self.etag]
+        if self.last_modified:
+            headers['If-Modified-Since'] = [self.last_modified]
+        return headers
+
+
+class ResponseCache(object):
+    """
+    Size-bounded LRU cache of responses, keyed by request path.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Bumped whenever entries are added or removed
+        self.version = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        self.version += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.version += 1
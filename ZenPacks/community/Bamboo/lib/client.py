@@ -0,0 +1,351 @@
+
+# stdlib Imports
+import base64
+import hashlib
+import json
+import logging
+import time
+
+from ZenPacks.community.Bamboo.lib.breaker import get_breaker, get_rate_limiter
+from ZenPacks.community.Bamboo.lib.cache import CacheEntry, ResponseCache
+from ZenPacks.community.Bamboo.lib.stats import CollectorStats
+from ZenPacks.community.Bamboo.lib.stream import read_items
+from ZenPacks.community.Bamboo.lib.utils import SkipCertifContextFactory
+
+# Twisted Imports
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredSemaphore, fail, gatherResults, inlineCallbacks, returnValue
+from twisted.internet.task import deferLater
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.client')
+
+# Maximum number of simultaneous requests sent to a single Bamboo host
+MAX_CONNECTIONS_PER_HOST = 4
+# Seconds an idle persistent connection is kept open
+CACHED_CONNECTION_TIMEOUT = 240
+# Maximum number of responses kept in the cache of a client
+MAX_CACHE_ENTRIES = 512
+
+
+class BambooError(Exception):
+    pass
+
+
+class BambooTimeout(BambooError):
+    pass
+
+
+class CircuitOpen(BambooError):
+    pass
+
+
+class BambooClient(object):
+    """
+    HTTPS client for the Bamboo REST API, backed by a persistent connection pool.
+
+    Use get_client() to obtain an instance, so that all collectors targeting the same Bamboo host with the same
+    credentials share the pool and its open connections.
+    """
+
+    def __init__(self, serverAlias, port, username, password):
+        # Seconds allowed for the response headers, then for the body, of each request
+        self.timeout = None
+        self.base_url = 'https://{}:{}/rest/api/latest'.format(serverAlias, port)
+
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = MAX_CONNECTIONS_PER_HOST
+        self.pool.cachedConnectionTimeout = CACHED_CONNECTION_TIMEOUT
+        self.agent = Agent(reactor, contextFactory=SkipCertifContextFactory(), pool=self.pool)
+        self.semaphore = DeferredSemaphore(MAX_CONNECTIONS_PER_HOST)
+        self.cache = ResponseCache(MAX_CACHE_ENTRIES)
+        self.stats = CollectorStats()
+        # Shared by all the clients of the same host
+        self.rate_limiter = get_rate_limiter((serverAlias, port))
+        self.breaker = get_breaker((serverAlias, port))
+
+        # The Authorization header is computed once, not on every request
+        basic_auth = base64.encodestring('{}:{}'.format(username, password))
+        self.headers = {
+            "Accept": ["application/json"],
+            "Authorization": ["Basic " + basic_auth.replace('\n', '')],
+            "User-Agent": ["Mozilla/3.0Gold"],
+        }
+
+    def url(self, path):
+        return '{}{}'.format(self.base_url, path)
+
+    def request(self, path, headers=None):
+        """
+        Send a GET request for path, relative to /rest/api/latest, and return a Deferred firing with the response.
+
+        Requests are spaced by the rate limiter of the host. The circuit breaker of the host is checked when a request
+        is actually sent, so that the requests queued behind the semaphore or the rate limiter fail with CircuitOpen
+        once it opens. The semaphore isn't taken here: get() and _fetch() hold it until the body is read.
+        """
+        url = self.url(path)
+        log.debug('request url: %s', url)
+        request_headers = Headers(self.headers)
+        for name, values in (headers or {}).items():
+            request_headers.setRawHeaders(name, values)
+
+        def send():
+            if not self.breaker.allow():
+                return self._circuit_open()
+            d = self._timeout(self.agent.request('GET', url, request_headers), path)
+            return d.addCallbacks(self._request_done, self._request_failed)
+
+        def throttle():
+            # No rate limiter token is taken by a request that would be rejected
+            if self.breaker.is_open():
+                return self._circuit_open()
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                return deferLater(reactor, delay, send)
+            return send()
+
+        return throttle()
+
+    def _circuit_open(self):
+        return fail(CircuitOpen('{}: circuit breaker open for {:.0f}s'.format(self.breaker.name,
+                                                                              self.breaker.remaining())))
+
+    def _request_done(self, response):
+        if response.code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        return response
+
+    def _request_failed(self, failure):
+        # Timeouts are already counted by _timeout
+        if not failure.check(BambooTimeout):
+            self.breaker.failure()
+        return failure
+
+    def _timeout(self, d, path):
+        """
+        Cancel d when it doesn't fire within self.timeout seconds, and fail it with BambooTimeout.
+        """
+        if not self.timeout:
+            return d
+        # Once cancelled, d fails with whatever the cancellation raised, e.g. ResponseNeverReceived
+        timed_out = []
+
+        def expire():
+            timed_out.append(True)
+            d.cancel()
+
+        call = reactor.callLater(self.timeout, expire)
+
+        def stop_timer(result):
+            if call.active():
+                call.cancel()
+            elif timed_out and isinstance(result, Failure):
+                self.breaker.failure()
+                raise BambooTimeout('{} timed out after {}s'.format(self.url(path), self.timeout))
+            return result
+
+        return d.addBoth(stop_timer)
+
+    def get(self, path):
+        # The connection is only released once the body is read
+        return self.semaphore.run(self._get, path)
+
+    @inlineCallbacks
+    def _get(self, path):
+        start = time.time()
+        response = yield self.request(path)
+        body = yield self._timeout(readBody(response), path)
+        self.stats.record_request(path, time.time() - start, len(body))
+        if response.code >= 400:
+            raise BambooError('{} returned HTTP {}'.format(self.url(path), response.code))
+        returnValue(body)
+
+    @inlineCallbacks
+    def get_json(self, path):
+        body = yield self.get(path)
+        returnValue(self._parse(body))
+
+    def _parse(self, body):
+        start = time.time()
+        data = json.loads(body)
+        self.stats.record_parse(time.time() - start)
+        return data
+
+    def get_listing(self, path, item, fields=None, keep=None):
+        """
+        Return a Deferred firing with a page of a listing, e.g. get_listing('/plan?expand=plans.plan', 'plans').
+
+        The body is parsed as it is received and only the given fields of each entry are kept. The page has the same
+        shape as the JSON document: {'plans': {'size': ..., 'max-result': ..., 'plan': [...]}}. With keep, a
+        predicate such as an ItemFilter, the entries it rejects are dropped as they are parsed.
+        """
+        return self._fetch(path, item=item, fields=fields, keep=keep).addCallback(lambda result: result[1])
+
+    @inlineCallbacks
+    def get_json_cached(self, path, ttl, item=None, fields=None, keep=None):
+        """
+        Return a Deferred firing with a (data, changed) tuple.
+
+        A response younger than ttl seconds is served from the cache without any request. An older one is
+        revalidated with If-None-Match/If-Modified-Since, and a payload identical to the cached one is not parsed
+        again. In both cases, changed is False. With item, the response is parsed as a listing, see get_listing.
+        """
+        # Entries filtered out aren't cached, the filter is part of the key
+        key = path if keep is None else (path, keep.key)
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh():
+            returnValue((entry.data, False))
+
+        if entry is None:
+            response, data, digest = yield self._fetch(path, item=item, fields=fields, keep=keep)
+        else:
+            response, data, digest = yield self._fetch(path, entry.conditional_headers(), item, fields, entry.digest,
+                                                       keep)
+            if data is None:
+                entry.expires = time.time() + ttl
+                returnValue((entry.data, False))
+
+        self.cache.put(key, CacheEntry(data,
+                                        digest=digest,
+                                        etag=response.headers.getRawHeaders('etag', [None])[0],
+                                        last_modified=response.headers.getRawHeaders('last-modified', [None])[0],
+                                        expires=time.time() + ttl))
+        returnValue((data, True))
+
+    def _fetch(self, path, headers=None, item=None, fields=None, digest=None, keep=None):
+        """
+        Return a Deferred firing with a (response, data, digest) tuple. data is None when the response is a 304, or
+        when the digest of its body is the digest given.
+        """
+        return self.semaphore.run(self._fetch_locked, path, headers, item, fields, digest, keep)
+
+    @inlineCallbacks
+    def _fetch_locked(self, path, headers, item, fields, digest, keep):
+        start = time.time()
+        response = yield self.request(path, headers)
+        if item is None or response.code >= 300:
+            body = yield self._timeout(readBody(response), path)
+            self.stats.record_request(path, time.time() - start, len(body))
+            if response.code >= 400:
+                raise BambooError('{} returned HTTP {}'.format(self.url(path), response.code))
+            body_digest = hashlib.sha1(body).hexdigest()
+            if response.code == 304 or body_digest == digest:
+                returnValue((response, None, digest))
+            returnValue((response, self._parse(body), body_digest))
+
+        parser = yield self._timeout(read_items(response, (item, item[:-1]), fields, keep), path)
+        self.stats.record_request(path, time.time() - start, parser.size)
+        self.stats.record_parse(parser.parse_time)
+        body_digest = parser.hexdigest()
+        if body_digest == digest:
+            returnValue((response, None, digest))
+        page = dict(parser.attributes)
+        page[item[:-1]] = parser.items
+        # Pages are stepped through by the number of entries returned, before filtering
+        page.setdefault('max-result', parser.count)
+        returnValue((response, {item: page}, body_digest))
+
+    def get_paged(self, path, item, page_size, semaphore=None, fields=None, keep=None):
+        """
+        Return all the entries of a paged listing, e.g. get_paged('/plan?expand=plans.plan', 'plans', 25).
+
+        The first page gives the total size, the remaining pages are then requested concurrently. All of them are
+        requested within the limits of semaphore when one is given. With fields or keep, pages are parsed as they are
+        received, see get_listing.
+        """
+        def get_page(url):
+            if fields or keep:
+                d = self.get_listing(url, item, fields, keep)
+            else:
+                d = self.get_json(url)
+            return d.addCallback(lambda data: (data, True))
+
+        d = self._get_paged(path, item, page_size, semaphore, get_page)
+        d.addCallback(lambda result: result[0])
+        return d
+
+    def get_paged_cached(self, path, item, page_size, ttl, semaphore=None, fields=None, keep=None):
+        """
+        Same as get_paged, but every page goes through get_json_cached. Returns a Deferred firing with a
+        (data, changed) tuple, where changed is False when no page changed.
+        """
+        def get_page(url):
+            return self.get_json_cached(url, ttl, item if fields or keep else None, fields, keep)
+
+        return self._get_paged(path, item, page_size, semaphore, get_page)
+
+    @inlineCallbacks
+    def _get_paged(self, path, item, page_size, semaphore, get_page):
+        item_single = item[:-1]
+        page_url = path + ('&' if '?' in path else '?') + 'max-result={}&start-index={}'
+
+        if semaphore is None:
+            response_body, changed = yield get_page(page_url.format(page_size, 0))
+        else:
+            response_body, changed = yield semaphore.run(get_page, page_url.format(page_size, 0))
+        data = list(response_body[item][item_single])
+        size = response_body[item]['size']
+        # Bamboo may return less entries than requested
+        step = response_body[item].get('max-result') or len(data) or page_size
+        offsets = range(step, size, step)
+        if not offsets:
+            returnValue((data, changed))
+
+        if semaphore is None:
+            deferreds = [get_page(page_url.format(step, offset)) for offset in offsets]
+        else:
+            deferreds = [semaphore.run(get_page, page_url.format(step, offset)) for offset in offsets]
+        pages = yield gatherResults(deferreds, consumeErrors=True)
+        for page, page_changed in pages:
+            data.extend(page[item][item_single])
+            changed = changed or page_changed
+        returnValue((data, changed))
+
+
+_clients = {}
+_device_semaphores = {}
+
+
+def get_client(serverAlias, port, username, password, timeout=None):
+    """
+    Return the shared BambooClient for this host and credentials, creating it on first use. When given, timeout
+    replaces the request timeout of the client.
+    """
+    key = (serverAlias, port, username, password)
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = BambooClient(serverAlias, port, username, password)
+    if timeout is not None:
+        client.timeout = timeout
+    return client
+
+
+def client_for(config, server=None):
+    """
+    Return the shared BambooClient for a datasource config or a device, configured from its zBamboo* properties.
+    server is the (alias, port) of the Bamboo server, zBambooServerAlias and zBambooPort by default.
+    """
+    alias, port = server or (config.zBambooServerAlias, config.zBambooPort)
+    client = get_client(alias, port, config.zBambooUsername, config.zBambooPassword,
+                        getattr(config, 'zBambooRequestTimeout', None))
+    client.rate_limiter.configure(getattr(config, 'zBambooRateLimit', 0))
+    client.breaker.configure(getattr(config, 'zBambooBreakerThreshold', 5),
+                             getattr(config, 'zBambooBreakerCooldown', 300))
+    return client
+
+
+def device_semaphore(device_id, limit):
+    """
+    Return the DeferredSemaphore shared by all the collection tasks of a device, so that they don't have more than
+    limit requests in flight together. A new limit applies once the device has no request in flight.
+    """
+    limit = limit or 1
+    semaphore = _device_semaphores.get(device_id)
+    if semaphore is None or (semaphore.limit != limit and semaphore.tokens == semaphore.limit):
+        semaphore = _device_semaphores[device_id] = DeferredSemaphore(limit)
+    return semaphore
@@ -0,0 +1,37 @@
+
+# stdlib Imports
+import re
+
+
+class ItemFilter(object):
+    """
+    Predicate on the entries of a Bamboo listing, applied while the listing is parsed.
+
+    An entry is kept when its key matches include, doesn't match exclude and, with skip_disabled, when it is enabled.
+    Patterns are regular expressions searched in the key, an empty pattern matches everything for include and nothing
+    for exclude. With parent, an ItemFilter on the project keys, the entry's projectKey must be kept by it as well.
+
+    key identifies the filter, e.g. to cache the filtered listings separately. Raises re.error when a pattern is
+    invalid.
+    """
+
+    def __init__(self, include='', exclude='', skip_disabled=False, parent=None):
+        self.include = re.compile(include) if include else None
+        self.exclude = re.compile(exclude) if exclude else None
+        self.skip_disabled = bool(skip_disabled)
+        self.parent = parent
+        self.key = (include or '', exclude or '', self.skip_disabled, parent.key if parent else None)
+
+    def accept_key(self, key):
+        if self.include is not None and not self.include.search(key):
+            return False
+        if self.exclude is not None and self.exclude.search(key):
+            return False
+        return True
+
+    def __call__(self, entry):
+        if self.skip_disabled and not entry.get('enabled', True):
+            return False
+        if self.parent is not None and not self.parent.accept_key(entry.get('projectKey') or ''):
+            return False
+        return self.accept_key(entry.get('key') or '')
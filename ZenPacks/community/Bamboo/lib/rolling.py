@@ -0,0 +1,107 @@
+
+# stdlib Imports
+import math
+from array import array
+
+# NumPy is optional, the statistics are then computed plan by plan
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of recent build durations kept per plan
+ROLLING_WINDOW = 50
+# Weight of the latest duration in the exponentially weighted moving average
+EWMA_ALPHA = 0.2
+# Number of durations needed before a z-score is computed
+MIN_SAMPLES = 10
+
+
+class RollingDurations(object):
+    """
+    Ring buffers of the recent build durations of many plans.
+
+    The buffers of all the plans are rows of a single array of doubles, window values per plan, so that the mean and
+    standard deviation of the plans are computed in one vectorized pass when NumPy is available. The EWMA of each plan
+    is updated as its durations are added.
+    """
+
+    def __init__(self, window=ROLLING_WINDOW, alpha=EWMA_ALPHA, min_samples=MIN_SAMPLES):
+        self.window = window
+        self.alpha = alpha
+        self.min_samples = min_samples
+        # plan_key -> row
+        self.index = {}
+        self.values = array('d')
+        # Number of durations ever added to each row, the next one goes to totals % window
+        self.totals = array('d')
+        self.ewma = array('d')
+        self._empty_row = array('d', [0.0]) * window
+
+    def __len__(self):
+        return len(self.index)
+
+    def _row(self, key):
+        row = self.index.get(key)
+        if row is None:
+            row = self.index[key] = len(self.totals)
+            self.values.extend(self._empty_row)
+            self.totals.append(0)
+            self.ewma.append(0)
+        return row
+
+    def stats(self, rows):
+        """
+        Return the means, standard deviations and sample counts of rows, as three lists.
+        """
+        if not rows:
+            return [], [], []
+        window = self.window
+        if numpy is not None:
+            rows = numpy.array(rows)
+            values = numpy.frombuffer(self.values, dtype=numpy.float64).reshape(-1, window)[rows]
+            counts = numpy.minimum(numpy.frombuffer(self.totals, dtype=numpy.float64)[rows], window)
+            samples = numpy.maximum(counts, 1)
+            # Unused slots are 0 and don't count in the sums
+            means = values.sum(axis=1) / samples
+            variances = numpy.maximum((values * values).sum(axis=1) / samples - means * means, 0)
+            return means.tolist(), numpy.sqrt(variances).tolist(), counts.tolist()
+
+        means, stddevs, counts = [], [], []
+        for row in rows:
+            values = self.values[row * window:(row + 1) * window]
+            count = min(self.totals[row], window)
+            samples = max(count, 1)
+            mean = sum(values) / samples
+            means.append(mean)
+            stddevs.append(math.sqrt(max(sum(v * v for v in values) / samples - mean * mean, 0)))
+            counts.append(count)
+        return means, stddevs, counts
+
+    def update(self, durations):
+        """
+        Add the new durations of plans, a {plan_key: [duration, ...]} dict with the oldest durations first.
+
+        Returns {plan_key: (zscore, ewma, mean, stddev)} for each plan with durations. mean and stddev are those of the
+        durations kept before this update, and zscore is the one of the latest duration against them. zscore is None
+        until min_samples durations are kept, or when they are all equal.
+        """
+        keys = [key for key, values in durations.items() if values]
+        rows = [self._row(key) for key in keys]
+        means, stddevs, counts = self.stats(rows)
+
+        window = self.window
+        alpha = self.alpha
+        results = {}
+        for key, row, mean, stddev, count in zip(keys, rows, means, stddevs, counts):
+            for duration in durations[key]:
+                total = int(self.totals[row])
+                self.values[row * window + total % window] = duration
+                self.ewma[row] = duration if not total else alpha * duration + (1 - alpha) * self.ewma[row]
+                self.totals[row] = total + 1
+            zscore = None
+            # Rounding leaves a tiny deviation when all the durations are equal
+            if count >= self.min_samples and stddev > abs(mean) * 1e-6:
+                zscore = (durations[key][-1] - mean) / stddev
+            results[key] = (zscore, self.ewma[row], mean, stddev)
+        return results
@@ -0,0 +1,60 @@
+
+# stdlib Imports
+import time
+import zlib
+
+# Default part of the cycle the tasks are spread over
+PHASE_SPREAD = 0.5
+
+
+class AdaptiveInterval(object):
+    """
+    Polling interval that follows the activity of the Bamboo server.
+
+    While builds are queued or completing, the interval stays at min_interval. Each idle cycle doubles it, up to
+    max_interval. wake() makes the next cycle due at once, e.g. when the build queue starts filling up.
+    """
+
+    def __init__(self, min_interval=60, max_interval=1800, backoff=2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.last_run = 0
+
+    def configure(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+
+    def due(self, now=None):
+        return (now or time.time()) >= self.last_run + self.interval
+
+    def update(self, busy, now=None):
+        if busy:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self.last_run = now or time.time()
+
+    def wake(self):
+        self.interval = self.min_interval
+        self.last_run = 0
+
+
+def phase_offset(key, cycle, spread=PHASE_SPREAD):
+    """
+    Return the phase of a collection task, in seconds from the start of its cycle. The phase is derived from the
+    config_key of the task, so that it is the same at every cycle and in every process, and is spread over the first
+    spread part of the cycle.
+    """
+    return (zlib.crc32(repr(key)) & 0xffffffff) % 1000 / 1000.0 * cycle * max(min(spread, 1), 0)
+
+
+def task_phase(config, kind):
+    """
+    Return the phase of the task of a datasource config, from its config_key (device, cycle time, kind, server id).
+    """
+    ds0 = config.datasources[0]
+    key = (config.id, ds0.cycletime, kind, ds0.params.get('server_id'))
+    return phase_offset(key, ds0.cycletime, getattr(ds0, 'zBambooPhaseSpread', PHASE_SPREAD) or 0)
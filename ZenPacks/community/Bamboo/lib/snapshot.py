@@ -0,0 +1,181 @@
+
+# stdlib Imports
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from Products.ZenUtils.Utils import prepId, zenPath
+from ZenPacks.community.Bamboo.lib.cache import CacheEntry
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.snapshot')
+
+# Bumped whenever the content of the snapshots changes, older snapshots are then ignored
+SNAPSHOT_VERSION = 2
+# Minimum number of seconds between two saves of the snapshot of a DeviceState
+SNAPSHOT_INTERVAL = 300
+
+
+def snapshot_path(state, daemon, directory=None):
+    """
+    Return the file of the snapshot of a DeviceState, e.g. $ZENHOME/var/bamboo/zenpython/device_bamboo.json.
+    """
+    directory = directory or zenPath('var', 'bamboo')
+    return os.path.join(directory, daemon, '{}_{}.json'.format(prepId(state.device_id), prepId(state.server_id)))
+
+
+def _key(value):
+    # Cache keys are paths, or (path, filter key) tuples that JSON turns into lists
+    if isinstance(value, list):
+        return tuple(_key(v) for v in value)
+    return value
+
+
+def _saved_state(state):
+    return {
+        'high_water': state.high_water,
+        'latest_builds': state.latest_builds,
+        'queued_since': state.queued_since,
+        'deployments': state.deployments,
+        'last_release': state.last_release,
+        'model_fingerprints': state.model_fingerprints,
+    }
+
+
+def snapshot_digest(state, client):
+    """
+    Return the digest of the content of the snapshot of a DeviceState. The times of the last poll and notification,
+    which change every cycle, and the expiry of the cached responses are left out, and the cached responses are only
+    represented by their validators.
+    """
+    cache = dict((repr(key), [entry.digest, entry.etag, entry.last_modified])
+                 for key, entry in client.cache.entries.items())
+    return hashlib.sha1(json.dumps([_saved_state(state), cache], separators=(',', ':'), sort_keys=True)).hexdigest()
+
+
+def dump_snapshot(state, client, cache=True):
+    """
+    Return the snapshot of a DeviceState and of the response cache of its client, as a JSON document.
+    """
+    saved = _saved_state(state)
+    saved['last_poll'] = state.last_poll
+    saved['last_webhook'] = state.last_webhook
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'device': state.device_id,
+        'server': state.server_id,
+        'state': saved,
+        'cache': [],
+    }
+    if cache:
+        snapshot['cache'] = [[key, {'data': entry.data, 'digest': entry.digest, 'etag': entry.etag,
+                                    'last_modified': entry.last_modified, 'expires': entry.expires}]
+                             for key, entry in client.cache.entries.items()]
+    return json.dumps(snapshot, separators=(',', ':'), sort_keys=True)
+
+
+def load_snapshot(state, client, body):
+    """
+    Restore a DeviceState and the response cache of its client from a snapshot. Returns False when the snapshot is
+    of another version, device or server.
+    """
+    snapshot = json.loads(body)
+    if (snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('device') != state.device_id or
+            snapshot.get('server') != state.server_id):
+        return False
+
+    saved = snapshot['state']
+    state.high_water.update(saved['high_water'])
+    state.latest_builds.update(saved.get('latest_builds', {}))
+    state.last_poll = saved['last_poll']
+    state.last_webhook = saved['last_webhook']
+    state.queued_since.update(saved['queued_since'])
+    state.deployments.update(saved.get('deployments', {}))
+    state.last_release.update(saved.get('last_release', {}))
+    fingerprints = saved['model_fingerprints']
+    if fingerprints is not None:
+        fingerprints['plans'] = dict((key, tuple(value)) for key, value in fingerprints['plans'].items())
+        state.model_fingerprints = fingerprints
+    for key, entry in snapshot['cache']:
+        key = _key(key)
+        # Responses received since the start are more recent
+        if client.cache.get(key) is None:
+            client.cache.put(key, CacheEntry(**dict((str(name), value) for name, value in entry.items())))
+    return True
+
+
+def restore_snapshot(state, client, daemon, max_size, directory=None):
+    """
+    Restore a DeviceState from its snapshot, once per process. max_size is the size limit of the snapshot in KB,
+    0 disables the snapshots.
+    """
+    if state.snapshot_digest is not None or not max_size:
+        return
+    state.snapshot_digest = ''
+    path = snapshot_path(state, daemon, directory)
+    try:
+        if not os.path.exists(path):
+            return
+        if os.path.getsize(path) > max_size * 1024:
+            log.warning('{}: snapshot {} is larger than {} KB, ignored'.format(state.device_id, path, max_size))
+            return
+        with open(path) as f:
+            body = f.read()
+        if load_snapshot(state, client, body):
+            state.snapshot_digest = snapshot_digest(state, client)
+            state.snapshot_cache_version = client.cache.version
+            log.info('{}: state of {} restored from {}'.format(state.device_id, state.server_id, path))
+        else:
+            log.info('{}: snapshot {} is outdated, ignored'.format(state.device_id, path))
+    except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+        log.warning('{}: failed to restore snapshot {}: {}'.format(state.device_id, path, e))
+
+
+def save_snapshot(state, client, daemon, max_size, directory=None, interval=SNAPSHOT_INTERVAL, now=None):
+    """
+    Write the snapshot of a DeviceState when it is dirty or the response cache of its client changed, at most once
+    every interval seconds. The file is replaced atomically. A snapshot larger than max_size KB is written without
+    the cached responses, or not at all when it still doesn't fit.
+    """
+    if not max_size or (not state.dirty and state.snapshot_cache_version == client.cache.version):
+        return
+    now = now or time.time()
+    if now - state.snapshot_time < interval:
+        return
+    state.dirty = False
+    state.snapshot_cache_version = client.cache.version
+    digest = snapshot_digest(state, client)
+    if digest == state.snapshot_digest:
+        return
+
+    state.snapshot_time = now
+    body = dump_snapshot(state, client)
+    if len(body) > max_size * 1024:
+        body = dump_snapshot(state, client, cache=False)
+        if len(body) > max_size * 1024:
+            log.warning('{}: snapshot of {} is larger than {} KB, not saved'.format(state.device_id, state.server_id,
+                                                                                 max_size))
+            return
+
+    path = snapshot_path(state, daemon, directory)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        state.snapshot_digest = digest
+    except (IOError, OSError) as e:
+        log.warning('{}: failed to save snapshot {}: {}'.format(state.device_id, path, e))
+        # Tried again after the interval
+        state.dirty = True
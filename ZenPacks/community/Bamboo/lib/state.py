@@ -0,0 +1,117 @@
+
+# stdlib Imports
+import logging
+from collections import OrderedDict, deque
+
+from ZenPacks.community.Bamboo.lib.rolling import RollingDurations
+from ZenPacks.community.Bamboo.lib.scheduler import AdaptiveInterval
+from ZenPacks.community.Bamboo.lib.stats import BUILD_WINDOW
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.state')
+
+# Maximum number of notified builds kept per server between two cycles
+MAX_WEBHOOK_BUILDS = 10000
+# Id of the server modeled from zBambooServerAlias
+DEFAULT_SERVER = 'bamboo'
+
+
+class DeviceState(object):
+    """
+    Collection state of a Bamboo server of a device, kept in memory between collection cycles.
+    """
+
+    def __init__(self, device_id, server_id=DEFAULT_SERVER):
+        self.device_id = device_id
+        self.server_id = server_id
+        # plan_key -> last buildNumber processed
+        self.high_water = {}
+        # plan_key -> number of missed builds to read back, in the order the plans were found
+        self.backfill = OrderedDict()
+        # plan_key -> buildNumber, buildState and buildCompletedTime of the latest completed build seen
+        self.latest_builds = {}
+        # Builds received through notifications, not reported yet
+        self.webhook_builds = deque(maxlen=MAX_WEBHOOK_BUILDS)
+        self.last_webhook = 0
+        # zBambooWebhookToken, required from the notifications when set
+        self.webhook_token = ''
+        self.last_poll = 0
+        # Adaptive polling of build results
+        self.schedule = AdaptiveInterval()
+        self.queue_length = 0
+        # Number of busy agents, i.e. of builds running
+        self.running_builds = 0
+        # buildResultKey -> first time the build was seen in the queue
+        self.queued_since = {}
+        # plan_key -> recent builds, as (completed, duration, queue_wait, successful)
+        self.build_windows = {}
+        # Recent build durations of all the plans, for anomaly detection
+        self.durations = RollingDurations()
+        # Agent component id -> (state, current job) last sent to the model
+        self.agent_states = {}
+        # environment_id -> id of the last deployment result processed
+        self.deployments = {}
+        # environment_id -> time of the last successful deployment, 0 when there is none
+        self.last_release = {}
+        # Fingerprints of the projects and plans of the last model, for delta modeling
+        self.model_fingerprints = None
+        # Set when a field kept in the snapshot changes, the times of the last poll and notification aside
+        self.dirty = False
+        # Digest of the last snapshot saved or restored, None until the snapshot is restored
+        self.snapshot_digest = None
+        # Time of the last save, and version of the response cache of the client saved with it
+        self.snapshot_time = 0
+        self.snapshot_cache_version = None
+
+    def add_build(self, plan_key, completed, duration, queue_wait, successful):
+        window = self.build_windows.get(plan_key)
+        if window is None:
+            window = self.build_windows[plan_key] = deque(maxlen=BUILD_WINDOW)
+        window.append((completed, duration, queue_wait, successful))
+        return window
+
+    def pop_webhook_builds(self):
+        builds = list(self.webhook_builds)
+        self.webhook_builds.clear()
+        return builds
+
+
+_states = {}
+# device_id -> ids of the Bamboo servers of the last model
+_modeled_servers = {}
+
+
+def get_state(device_id, server_id=DEFAULT_SERVER):
+    """
+    Return the DeviceState of a Bamboo server of a device, creating it on first use.
+    """
+    key = (device_id, server_id)
+    state = _states.get(key)
+    if state is None:
+        state = _states[key] = DeviceState(device_id, server_id)
+    return state
+
+
+def find_state(device_id, server_id=DEFAULT_SERVER):
+    """
+    Return the DeviceState of a Bamboo server of a device, or None when it isn't collected by this process.
+    """
+    return _states.get((device_id, server_id))
+
+
+def update_modeled_servers(device_id, server_ids):
+    """
+    Record the ids of the Bamboo servers modeled for a device. Returns True when they differ from the previous ones,
+    or when the device wasn't modeled since the process started.
+    """
+    server_ids = sorted(server_ids)
+    changed = _modeled_servers.get(device_id) != server_ids
+    _modeled_servers[device_id] = server_ids
+    return changed
+
+
+def state_for(config):
+    """
+    Return the DeviceState of the Bamboo server collected by a datasource config.
+    """
+    return get_state(config.id, config.datasources[0].params.get('server_id') or DEFAULT_SERVER)
@@ -0,0 +1,100 @@
+
+# stdlib Imports
+import math
+from collections import deque
+
+# Endpoints whose latency is reported separately
+ENDPOINTS = ('info', 'queue', 'result', 'plan', 'project')
+# Number of requests per endpoint used to compute the latency percentiles
+LATENCY_WINDOW = 200
+# Number of recent builds per plan used to compute the build metrics
+BUILD_WINDOW = 100
+
+
+def endpoint_name(path):
+    """
+    Return the endpoint of a path relative to /rest/api/latest, e.g. 'result' for '/result/PRJ-PLAN?expand=...'.
+    """
+    return path.lstrip('/').split('?', 1)[0].split('/', 1)[0]
+
+
+def percentile(values, pct):
+    """
+    Return the pct percentile of values, using the nearest-rank method. Returns None when values is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def build_metrics(builds, now):
+    """
+    Return the datapoint values of a plan computed from its recent builds, a sequence of (completed, duration,
+    queue_wait, successful) tuples. Times are in seconds and queue_wait is None when unknown.
+    """
+    if not builds:
+        return {}
+    durations = [duration for _, duration, _, _ in builds]
+    waits = [wait for _, _, wait, _ in builds if wait is not None]
+    values = {
+        'duration_p50': percentile(durations, 50),
+        'duration_p90': percentile(durations, 90),
+        'duration_max': max(durations),
+        'success_ratio': 100.0 * sum(1 for build in builds if build[3]) / len(builds),
+        'builds_per_hour': sum(1 for build in builds if build[0] and now - build[0] < 3600),
+    }
+    if waits:
+        values['queue_wait_p50'] = percentile(waits, 50)
+        values['queue_wait_p90'] = percentile(waits, 90)
+    return values
+
+
+class CollectorStats(object):
+    """
+    Cost of the requests sent to a Bamboo server, accumulated between two reports.
+
+    Counters are reset by report(), while the latencies are kept over a sliding window of requests per endpoint.
+    """
+
+    def __init__(self):
+        self.latencies = dict((endpoint, deque(maxlen=LATENCY_WINDOW)) for endpoint in ENDPOINTS)
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.parse_time = 0.0
+        self.components_updated = 0
+
+    def record_request(self, path, latency, size):
+        self.requests += 1
+        self.bytes_received += size
+        latencies = self.latencies.get(endpoint_name(path))
+        if latencies is not None:
+            latencies.append(latency)
+
+    def record_parse(self, seconds):
+        self.parse_time += seconds
+
+    def record_components(self, count):
+        self.components_updated += count
+
+    def report(self):
+        """
+        Return the datapoint values since the previous report, and reset the counters.
+        """
+        values = {
+            'request_count': self.requests,
+            'bytes_received': self.bytes_received,
+            'parse_time': self.parse_time,
+            'components_updated': self.components_updated,
+        }
+        for endpoint, latencies in self.latencies.items():
+            for pct in (50, 95):
+                value = percentile(latencies, pct)
+                if value is not None:
+                    values['{}_latency_p{}'.format(endpoint, pct)] = value
+        self.reset()
+        return values
@@ -0,0 +1,249 @@
+
+# stdlib Imports
+import codecs
+import hashlib
+import json
+import re
+import time
+
+# Twisted Imports
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import Protocol
+from twisted.web.client import ResponseDone
+from twisted.web.http import PotentialDataLoss
+
+# Structural characters, or the start of a scalar value
+TOKEN = re.compile(r'[{}\[\]",:]|[^\s{}\[\]",:]+')
+# Characters that matter while skipping over an entry
+ENTRY_TOKEN = re.compile(r'[{}\[\]"]')
+# Rest of a string, up to and including its closing quote
+STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+
+
+class _Frame(object):
+
+    __slots__ = ('kind', 'path', 'key')
+
+    def __init__(self, kind, path):
+        self.kind = kind
+        self.path = path
+        self.key = None
+
+
+class JsonItemParser(object):
+    """
+    Incremental parser of Bamboo listings, such as {"plans": {"size": 3, "plan": [{...}, {...}, {...}]}}.
+
+    Data is fed chunk by chunk. Each entry of the array found at path, e.g. ('plans', 'plan'), is decoded on its own
+    as soon as it is complete, and only its fields are kept. The scalar values of the enclosing object (size,
+    start-index, max-result) are kept in attributes. The rest of the document is skipped, so that memory use
+    depends on the size of a single entry rather than on the size of the document.
+
+    A field can be a dotted name, e.g. 'plan.key', to keep a single attribute of a nested object. With keep, a
+    predicate called with each entry before its fields are selected, the entries it rejects are dropped.
+    """
+
+    def __init__(self, path, fields=None, keep=None):
+        self.path = tuple(path)
+        self.fields = fields
+        self.keep = keep
+        self.items = []
+        # Entries parsed, and entries dropped by keep
+        self.count = 0
+        self.skipped = 0
+        self.attributes = {}
+        self.digest = hashlib.sha1()
+        # Bytes received and time spent parsing them
+        self.size = 0
+        self.parse_time = 0.0
+
+        self._buffer = ''
+        self._pos = 0
+        self._stack = []
+        self._expect_key = False
+        self._entry_start = None
+        self._entry_depth = 0
+        self._decoder = None if isinstance(b'', str) else codecs.getincrementaldecoder('utf-8')()
+
+    def feed(self, data):
+        started = time.time()
+        self.size += len(data)
+        self.digest.update(data)
+        if self._decoder is not None:
+            data = self._decoder.decode(data)
+        self._buffer += data
+        self._parse()
+
+        # Only keep the part of the buffer that was not consumed yet
+        start = self._pos if self._entry_start is None else self._entry_start
+        if start:
+            self._buffer = self._buffer[start:]
+            self._pos -= start
+            if self._entry_start is not None:
+                self._entry_start = 0
+        self.parse_time += time.time() - started
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def _parse(self):
+        buf = self._buffer
+        pos = self._pos
+        while True:
+            if self._entry_start is not None:
+                match = ENTRY_TOKEN.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                token = match.group()
+                if token == '"':
+                    end = STRING_END.match(buf, match.end())
+                    if end is None:
+                        pos = match.start()
+                        break
+                    pos = end.end()
+                    continue
+                pos = match.end()
+                if token in '{[':
+                    self._entry_depth += 1
+                    continue
+                self._entry_depth -= 1
+                if self._entry_depth == 0:
+                    self._add(json.loads(buf[self._entry_start:pos]))
+                    self._entry_start = None
+                    self._close()
+                continue
+
+            match = TOKEN.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            token = match.group()
+            top = self._stack[-1] if self._stack else None
+
+            if token == '"':
+                end = STRING_END.match(buf, match.end())
+                if end is None:
+                    pos = match.start()
+                    break
+                pos = end.end()
+                value = json.loads(buf[match.start():pos])
+                if top is not None and top.kind == '{' and self._expect_key:
+                    top.key = value
+                else:
+                    self._scalar(top, value)
+            elif token in '{[':
+                pos = match.end()
+                if top is None:
+                    path = ()
+                elif top.kind == '{':
+                    path = top.path + (top.key,)
+                else:
+                    path = top.path
+                if token == '{' and top is not None and top.kind == '[' and top.path == self.path:
+                    self._entry_start = match.start()
+                    self._entry_depth = 1
+                    continue
+                self._stack.append(_Frame(token, path))
+                self._expect_key = token == '{'
+            elif token in '}]':
+                pos = match.end()
+                self._stack.pop()
+                self._close()
+            elif token == ',':
+                pos = match.end()
+                self._expect_key = top is not None and top.kind == '{'
+            elif token == ':':
+                pos = match.end()
+                self._expect_key = False
+            else:
+                # Literal: number, true, false or null. It may continue in the next chunk.
+                if match.end() == len(buf):
+                    pos = match.start()
+                    break
+                pos = match.end()
+                self._scalar(top, json.loads(token))
+        self._pos = pos
+
+    def _close(self):
+        self._expect_key = False
+
+    def _scalar(self, top, value):
+        if top is not None and top.kind == '{' and top.path == self.path[:-1]:
+            self.attributes[top.key] = value
+
+    def _add(self, entry):
+        self.count += 1
+        if self.keep is not None and not self.keep(entry):
+            self.skipped += 1
+            return
+        self.items.append(self._select(entry))
+
+    def _select(self, entry):
+        if self.fields is None:
+            return entry
+        selected = {}
+        for field in self.fields:
+            names = field.split('.')
+            value = entry
+            for name in names:
+                if not isinstance(value, dict) or name not in value:
+                    break
+                value = value[name]
+            else:
+                target = selected
+                for name in names[:-1]:
+                    target = target.setdefault(name, {})
+                target[names[-1]] = value
+        return selected
+
+
+class _JsonItemProtocol(Protocol):
+    """
+    Feed a response body to a JsonItemParser, as it is received.
+    """
+
+    def __init__(self, parser, deferred):
+        self.parser = parser
+        self.deferred = deferred
+        self.error = None
+
+    def dataReceived(self, data):
+        # Nothing is parsed after an error, or once the read is cancelled
+        if self.error is not None or self.deferred is None:
+            return
+        try:
+            self.parser.feed(data)
+        except Exception as e:
+            self.error = e
+
+    def connectionLost(self, reason):
+        if self.deferred is None:
+            return
+        if self.error is not None:
+            self.deferred.errback(self.error)
+        elif reason.check(ResponseDone, PotentialDataLoss):
+            self.deferred.callback(self.parser)
+        else:
+            self.deferred.errback(reason)
+
+
+def read_items(response, path, fields=None, keep=None):
+    """
+    Parse the body of response with a JsonItemParser. Returns a Deferred firing with the parser once the body is
+    completely received. Cancelling it, e.g. on a timeout, closes the connection instead of reading the rest of the
+    body.
+    """
+    def cancel(d):
+        protocol.deferred = None
+        transport = protocol.transport
+        abort = getattr(transport, 'abortConnection', None)
+        if abort is not None:
+            abort()
+        elif transport is not None:
+            transport.stopProducing()
+
+    d = Deferred(cancel)
+    protocol = _JsonItemProtocol(JsonItemParser(path, fields, keep), d)
+    response.deliverBody(protocol)
+    return d
@@ -0,0 +1,48 @@
+
+# stdlib Imports
+import logging
+
+from ZenPacks.community.Bamboo.lib.client import client_for, device_semaphore
+from ZenPacks.community.Bamboo.lib.scheduler import task_phase
+from ZenPacks.community.Bamboo.lib.snapshot import restore_snapshot
+from ZenPacks.community.Bamboo.lib.state import state_for
+from ZenPacks.community.Bamboo.lib.utils import server_address
+
+# Twisted Imports
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import deferLater
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.task')
+
+
+@inlineCallbacks
+def prepare_task(config, kind, skip_open=True):
+    """
+    Start the collect of a datasource config: restore the DeviceState from its snapshot, then wait for the phase of
+    the task in its cycle. kind is the kind of the task in its config_key, e.g. 'bambooResults'.
+
+    Returns a Deferred firing with the (client, state, semaphore) of the task, or with None when the task is skipped:
+    zBambooServerAlias is empty, or the circuit breaker of the server is open and skip_open is set.
+    """
+    ds0 = config.datasources[0]
+    server = server_address(ds0)
+    if not server[0]:
+        log.error("%s: zBambooServerAlias cannot be empty", config.id)
+        returnValue(None)
+
+    client = client_for(ds0, server)
+    state = state_for(config)
+    # After a restart, builds already reported aren't reported again
+    restore_snapshot(state, client, 'zenpython', ds0.zBambooSnapshotMaxSize)
+    if skip_open and client.breaker.is_open():
+        # Reported once by the BambooServer datasources
+        log.debug('{}: circuit breaker of {} is open, {} skipped'.format(config.id, client.breaker.name, kind))
+        returnValue(None)
+    semaphore = device_semaphore(config.id, ds0.zBambooMaxConcurrentRequests)
+    # Tasks with the same cycle time are spread over the cycle instead of all starting together
+    phase = task_phase(config, kind)
+    if phase:
+        yield deferLater(reactor, phase, lambda: None)
+    returnValue((client, state, semaphore))
@@ -1,3 +1,8 @@
+import calendar
+import re
+
+from Products.ZenUtils.Utils import prepId
+
 from twisted.internet import ssl
 from twisted.web.client import BrowserLikePolicyForHTTPS
 from twisted.web.iweb import IPolicyForHTTPS
@@ -11,3 +16,96 @@ class SkipCertifContextFactory(object):
 
     def creatorForNetloc(self, hostname, port):
         return ssl.CertificateOptions(verify=False)
+
+
+BAMBOO_TIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(\.\d+)?(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def parse_bamboo_time(value):
+    """
+    Convert a Bamboo ISO 8601 timestamp, e.g. 2019-03-05T10:11:12.123+01:00, to seconds since the epoch.
+    Returns None when the value can't be parsed.
+    """
+    match = BAMBOO_TIME.match(value or '')
+    if not match:
+        return None
+    groups = match.groups()
+    timestamp = calendar.timegm(tuple(int(g) for g in groups[:6]))
+    if groups[6]:
+        timestamp += float(groups[6])
+    tz = groups[7]
+    if tz and tz != 'Z':
+        offset = int(tz[1:3]) * 3600 + int(tz[-2:]) * 60
+        timestamp += -offset if tz[0] == '+' else offset
+    return timestamp
+
+
+def bamboo_server(component):
+    """
+    Return the BambooServer component a project, plan, agent, deployment project or environment belongs to. A
+    BambooServer is returned as is.
+    """
+    if hasattr(component, 'bambooProject'):
+        component = component.bambooProject()
+    if hasattr(component, 'bambooDeploymentProject'):
+        component = component.bambooDeploymentProject()
+    if hasattr(component, 'bambooServer'):
+        component = component.bambooServer()
+    return component
+
+
+def server_params(context):
+    """
+    Return the datasource params identifying the Bamboo server of a component.
+    """
+    server = bamboo_server(context)
+    return {
+        'server_id': server.id,
+        'server_alias': getattr(server, 'server_alias', None),
+        'server_port': getattr(server, 'server_port', None),
+    }
+
+
+def server_address(datasource):
+    """
+    Return the (alias, port) of the Bamboo server of a datasource config. Servers modeled before the server_alias
+    and server_port properties existed fall back to zBambooServerAlias and zBambooPort.
+    """
+    params = datasource.params
+    return (params.get('server_alias') or datasource.zBambooServerAlias,
+            params.get('server_port') or datasource.zBambooPort)
+
+
+# Maximum number of keys memoized by a BoundedMemo
+MAX_MEMO_KEYS = 65536
+
+
+class BoundedMemo(object):
+    """
+    Memoized function of a single hashable key, e.g. BoundedMemo(prepId).
+
+    The same keys come back at every cycle, so their values are computed once. When max_keys keys are memoized, the
+    mapping is emptied rather than grown, the keys of deleted components don't pile up.
+    """
+
+    def __init__(self, function, max_keys=MAX_MEMO_KEYS):
+        self.function = function
+        self.max_keys = max_keys
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __call__(self, key):
+        value = self.values.get(key)
+        if value is None:
+            if len(self.values) >= self.max_keys:
+                self.values.clear()
+            value = self.values[key] = self.function(key)
+        return value
+
+
+# Component id of a project, plan or agent key, shared by the modeler and the collectors
+component_id = BoundedMemo(prepId)
+# compname of the plans of a project, from a (server id, project key) tuple
+project_compname = BoundedMemo(lambda key: 'bambooServers/{}/bambooProjects/{}'.format(*key))
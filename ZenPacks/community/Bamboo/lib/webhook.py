@@ -0,0 +1,173 @@
+
+# stdlib Imports
+import hmac
+import json
+import logging
+import re
+import time
+
+from ZenPacks.community.Bamboo.lib.state import DEFAULT_SERVER, find_state
+from ZenPacks.community.Bamboo.lib.utils import parse_bamboo_time
+
+# Twisted Imports
+from twisted.internet import reactor
+from twisted.internet.error import CannotListenError
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.webhook')
+
+# PROJ-PLAN-123 or PROJ-PLAN-JOB1-123
+BUILD_RESULT_KEY = re.compile(r'^(?P<plan_key>.+)-(?P<number>\d+)$')
+# PROJ-PLAN or PROJ-PLAN-JOB1
+PLAN_KEY = re.compile(r'^[\w-]+$')
+
+# Notifications of a build number further than this beyond the last build processed are rejected
+MAX_BUILD_NUMBER_GAP = 1000
+# Header, or query argument, carrying zBambooWebhookToken
+TOKEN_HEADER = 'X-Bamboo-Token'
+TOKEN_ARGUMENT = 'token'
+
+BUILD_STATES = {
+    'success': 'Successful',
+    'successful': 'Successful',
+    'failed': 'Failed',
+    'failure': 'Failed',
+}
+
+
+def parse_notification(payload):
+    """
+    Convert a Bamboo build notification to an entry shaped like the ones of the /result listing: plan.key,
+    buildNumber, buildState, lifeCycleState, buildDuration (ms), buildCompletedTime, buildStartedTime and
+    queueStartedTime.
+
+    Both the webhook payload of Bamboo, where the build is described under 'build', and a plain /result entry are
+    accepted. Returns None when the payload isn't about a completed build, and raises ValueError when the fields of
+    the build are malformed, e.g. a build number that isn't a number.
+    """
+    if not isinstance(payload, dict):
+        return None
+    build = payload.get('build', payload)
+    if not isinstance(build, dict):
+        return None
+
+    try:
+        match = BUILD_RESULT_KEY.match(build.get('buildResultKey') or '')
+        plan_key = (build.get('plan') or {}).get('key') or build.get('planKey') or (match and match.group('plan_key'))
+        number = build.get('buildNumber') or (match and match.group('number'))
+        state = build.get('buildState') or build.get('status') or build.get('state') or ''
+        state = BUILD_STATES.get(state.lower())
+        if not plan_key or not number or not state:
+            return None
+        if not PLAN_KEY.match(plan_key):
+            raise ValueError('invalid plan key {!r}'.format(plan_key))
+        number = int(number)
+
+        duration = build.get('buildDuration', build.get('duration'))
+        completed = build.get('buildCompletedTime') or build.get('finishedAt') or build.get('completedDate')
+        if duration is None:
+            started = parse_bamboo_time(build.get('buildStartedTime') or build.get('startedAt'))
+            finished = parse_bamboo_time(completed)
+            if started is None or finished is None:
+                return None
+            duration = (finished - started) * 1000
+        duration = float(duration)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError('malformed build notification: {}'.format(e))
+
+    return {
+        'plan': {'key': plan_key},
+        'buildNumber': number,
+        'buildState': state,
+        'lifeCycleState': 'Finished',
+        'buildDuration': duration,
+        'buildCompletedTime': completed,
+        'buildStartedTime': build.get('buildStartedTime') or build.get('startedAt'),
+        'queueStartedTime': build.get('queueStartedTime'),
+    }
+
+
+class WebhookResource(Resource):
+    """
+    Receive the build notifications POSTed by Bamboo on /bamboo/<device id>, or on /bamboo/<device id>/<server id>
+    when the device has several Bamboo servers.
+
+    Only the devices and servers collected by this process are accepted, with their zBambooWebhookToken when it is
+    set, either in the X-Bamboo-Token header or in the token query argument. Completed builds are queued in the
+    DeviceState of the device, and reported by its next collection cycle. A build is only accepted once its plan has
+    a high-water mark, and when its number isn't implausibly far beyond it.
+    """
+
+    isLeaf = True
+
+    def render_POST(self, request):
+        if len(request.postpath) not in (2, 3) or request.postpath[0] != 'bamboo' or not all(request.postpath[1:]):
+            request.setResponseCode(404)
+            return ''
+        device_id = request.postpath[1]
+        server_id = request.postpath[2] if len(request.postpath) == 3 else DEFAULT_SERVER
+        # Unknown devices don't get a state, they would never be collected
+        state = find_state(device_id, server_id)
+        if state is None:
+            request.setResponseCode(404)
+            return ''
+        token = request.getHeader(TOKEN_HEADER) or request.args.get(TOKEN_ARGUMENT, [''])[0]
+        if state.webhook_token and not hmac.compare_digest(str(token), str(state.webhook_token)):
+            log.warning('{}: notification from {} rejected, invalid token'.format(device_id,
+                                                                                   request.getClientIP()))
+            request.setResponseCode(403)
+            return ''
+
+        try:
+            payload = json.loads(request.content.read())
+        except ValueError:
+            request.setResponseCode(400)
+            return ''
+
+        try:
+            build = parse_notification(payload)
+        except ValueError as e:
+            log.warning('{}: notification from {} rejected, {}'.format(device_id, request.getClientIP(), e))
+            request.setResponseCode(400)
+            return ''
+        if build is None:
+            log.debug('%s: ignored notification %s', device_id, payload)
+            request.setResponseCode(202)
+            return ''
+        plan_key = build['plan']['key']
+        last_number = state.high_water.get(plan_key)
+        if last_number is None:
+            # The plan is picked up by the next poll of the /result listing
+            log.debug('%s: ignored build %s #%s, plan not polled yet', device_id, plan_key, build['buildNumber'])
+        elif build['buildNumber'] > last_number + MAX_BUILD_NUMBER_GAP:
+            log.warning('{}: notification of build {} #{} rejected, the last build processed is #{}'.format(
+                device_id, plan_key, build['buildNumber'], last_number))
+            request.setResponseCode(400)
+            return ''
+        else:
+            log.debug('%s: received build %s #%s', device_id, plan_key, build['buildNumber'])
+            state.webhook_builds.append(build)
+            state.last_webhook = time.time()
+        request.setResponseCode(202)
+        return ''
+
+
+_listeners = {}
+
+
+def start_listener(port, interface='127.0.0.1'):
+    """
+    Start listening for Bamboo notifications on port of interface, unless it's already done. Returns the listening
+    port, or None when the port can't be opened.
+    """
+    key = (interface, port)
+    if key not in _listeners:
+        try:
+            _listeners[key] = reactor.listenTCP(port, Site(WebhookResource()), interface=interface)
+            log.info('Listening for Bamboo notifications on {}:{}'.format(interface or '*', port))
+        except CannotListenError as e:
+            log.error('Cannot listen for Bamboo notifications on {}:{}: {}'.format(interface or '*', port, e))
+            _listeners[key] = None
+    return _listeners[key]
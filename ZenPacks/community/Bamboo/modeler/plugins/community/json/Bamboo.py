@@ -1,18 +1,19 @@
 # stdlib Imports
-import base64
-import json
+import hashlib
+import re
 import time
 
 # Zenoss Imports
 from Products.DataCollector.plugins.CollectorPlugin import PythonPlugin
 from Products.DataCollector.plugins.DataMaps import ObjectMap, RelationshipMap
-from ZenPacks.community.Bamboo.lib.utils import SkipCertifContextFactory
+from ZenPacks.community.Bamboo.lib.client import client_for, device_semaphore
+from ZenPacks.community.Bamboo.lib.filters import ItemFilter
+from ZenPacks.community.Bamboo.lib.snapshot import restore_snapshot, save_snapshot
+from ZenPacks.community.Bamboo.lib.state import DEFAULT_SERVER, get_state, update_modeled_servers
+from ZenPacks.community.Bamboo.lib.utils import component_id, project_compname
 
 # Twisted Imports
-from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, returnValue
-from twisted.web.client import Agent, readBody
-from twisted.web.http_headers import Headers
+from twisted.internet.defer import DeferredList, gatherResults, inlineCallbacks, returnValue
 
 
 class Bamboo(PythonPlugin):
@@ -25,70 +26,182 @@ class Bamboo(PythonPlugin):
         'zBambooUsername',
         'zBambooPassword',
         'zBambooServerAlias',
+        'zBambooServerAliases',
+        'zBambooRequestTimeout',
+        'zBambooPageSize',
+        'zBambooMaxConcurrentRequests',
+        'zBambooInfoCacheTTL',
+        'zBambooProjectsCacheTTL',
+        'zBambooPlansCacheTTL',
+        'zBambooDeltaModeling',
+        'zBambooProjectsInclude',
+        'zBambooProjectsExclude',
+        'zBambooPlansInclude',
+        'zBambooPlansExclude',
+        'zBambooSkipDisabledPlans',
+        'zBambooRateLimit',
+        'zBambooBreakerThreshold',
+        'zBambooBreakerCooldown',
+        'zBambooSnapshotMaxSize',
     )
 
     deviceProperties = PythonPlugin.deviceProperties + requiredProperties
 
+    # Listings that aren't paged, and aren't required to model the server
+    optional_urls = {
+        'agents': '/agent',
+        'deployments': '/deploy/project/all',
+    }
+
+    # Attributes kept from the entries of the listings
+    fields = {
+        'projects': ('key', 'name', 'description'),
+        'plans': ('key', 'name', 'enabled', 'type', 'projectKey'),
+    }
+
+
+    def servers(self, device, log):
+        """
+        Return the (id, alias, port) of the Bamboo servers of device. The server of zBambooServerAlias keeps the id
+        'bamboo', the ones of zBambooServerAliases, given as host or host:port, are named after their entry. Entries
+        with an invalid port, or whose id is already taken, are skipped.
+        """
+        port = getattr(device, 'zBambooPort', None)
+        servers = []
+        alias = getattr(device, 'zBambooServerAlias', None)
+        if alias:
+            servers.append((DEFAULT_SERVER, alias, port))
+        for entry in getattr(device, 'zBambooServerAliases', None) or []:
+            entry = entry.strip()
+            if not entry:
+                continue
+            alias, _, entry_port = entry.partition(':')
+            try:
+                entry_port = int(entry_port) if entry_port else port
+            except ValueError:
+                log.error('{}: invalid port in zBambooServerAliases entry {}'.format(device.id, entry))
+                continue
+            if any((alias, entry_port) == (a, p) for _, a, p in servers):
+                continue
+            server_id = self.prepId(entry)
+            if server_id in (s for s, _, _ in servers):
+                log.error('{}: zBambooServerAliases entry {} clashes with server id {}'.format(device.id, entry,
+                                                                                            server_id))
+                continue
+            servers.append((server_id, alias, entry_port))
+        return servers
 
     @inlineCallbacks
     def collect(self, device, log):
-        log.debug('{}: Modeling collect'.format(device.id))
+        log.debug('%s: Modeling collect', device.id)
 
-        port = getattr(device, 'zBambooPort', None)
-        username = getattr(device, 'zBambooUsername', None)
-        password = getattr(device, 'zBambooPassword', None)
-        serverAlias = getattr(device, 'zBambooServerAlias', None)
-        if not serverAlias:
-            log.error("%s: zBambooServerAlias cannot be empty", device.id)
+        servers = self.servers(device, log)
+        if not servers:
+            log.error("%s: zBambooServerAlias and zBambooServerAliases cannot both be empty", device.id)
             returnValue(None)
 
-        basic_auth = base64.encodestring('{}:{}'.format(username, password))
-        auth_header = "Basic " + basic_auth.strip()
-        headers = {
-                      "Accept":['application/json'],
-                      "Authorization": [auth_header],
-                      "User-Agent": ['Mozilla/3.0Gold'],
-                  }
+        # Projects and plans left out are dropped while the listings are parsed
+        try:
+            project_filter = ItemFilter(getattr(device, 'zBambooProjectsInclude', ''),
+                                        getattr(device, 'zBambooProjectsExclude', ''))
+            plan_filter = ItemFilter(getattr(device, 'zBambooPlansInclude', ''),
+                                     getattr(device, 'zBambooPlansExclude', ''),
+                                     getattr(device, 'zBambooSkipDisabledPlans', False),
+                                     project_filter)
+        except re.error as e:
+            log.error('{}: invalid project or plan filter: {}'.format(device.id, e))
+            returnValue(None)
+        filters = {
+            'projects': project_filter,
+            'plans': plan_filter,
+        }
+
+        # Servers are modeled in parallel, each one through its own client
+        responses = yield DeferredList([self.collect_server(device, server_id, alias, port, filters, log)
+                                        for server_id, alias, port in servers],
+                                       consumeErrors=True)
+        results = {'servers': {}}
+        # Servers added to or removed from zBambooServerAliases are remodeled even when no response changed, and so is
+        # the first model after a restart, whose responses may all be served from the restored snapshot
+        changed = update_modeled_servers(device.id, [server_id for server_id, _, _ in servers])
+        for (server_id, alias, port), (success, server_results) in zip(servers, responses):
+            if not success:
+                log.error('{}: failed to model Bamboo server {}: {}'.format(device.id, alias,
+                                                                            server_results.getErrorMessage()))
+                server_results = None
+            elif server_results is not None:
+                changed = changed or server_results.pop('changed')
+            else:
+                # Kept as is until it answers again
+                changed = True
+            results['servers'][server_id] = {'alias': alias, 'port': port, 'results': server_results}
+
+        # Nothing to remodel when the responses are identical to the previous ones
+        if not changed:
+            log.info('%s: Bamboo projects, plans and agents are unchanged', device.id)
+            returnValue(None)
 
+        returnValue(results)
+
+    @inlineCallbacks
+    def collect_server(self, device, server_id, alias, port, filters, log):
+        """
+        Return the responses of a Bamboo server, with changed set when one of them differs from the previous model.
+        Returns None when its circuit breaker is open.
+        """
+        page_size = getattr(device, 'zBambooPageSize', None) or 25
+        concurrency = getattr(device, 'zBambooMaxConcurrentRequests', None) or 1
         results = {}
-        agent = Agent(reactor, contextFactory=SkipCertifContextFactory())
+        client = client_for(device, (alias, port))
+        semaphore = device_semaphore(device.id, concurrency)
+        # After a restart, the cached responses are revalidated rather than downloaded again
+        restore_snapshot(get_state(device.id, server_id), client, 'zenmodeler',
+                         getattr(device, 'zBambooSnapshotMaxSize', 0))
+        if client.breaker.is_open():
+            log.warning('{}: circuit breaker of {} is open, modeling skipped'.format(device.id, client.breaker.name))
+            returnValue(None)
 
-        # TODO: use try..except
-        # TODO: check response.code
         # Bamboo server
-        url = 'https://{}:{}/rest/api/latest/info'.format(serverAlias, port)
-        log.debug('collect url: {}'.format(url))
-
-        response = yield agent.request('GET', url, Headers(headers))
-        response_body = yield readBody(response)
-        response_body = json.loads(response_body)
+        response_body, changed = yield semaphore.run(client.get_json_cached, '/info',
+                                                     getattr(device, 'zBambooInfoCacheTTL', 0))
         results['bamboo'] = response_body
 
-        # https://bamboo.fednot.be/rest/api/latest/plan/?expand=plans.plan
-
         # Projects, Plans
         urls = {
-            'projects': 'https://{}:{}/rest/api/latest/project?max-result={}&start-index={}',
-            'plans': 'https://{}:{}/rest/api/latest/plan/?expand=plans.plan&max-result={}&start-index={}',
+            'projects': '/project',
+            'plans': '/plan/?expand=plans.plan',
+        }
+        ttls = {
+            'projects': getattr(device, 'zBambooProjectsCacheTTL', 0),
+            'plans': getattr(device, 'zBambooPlansCacheTTL', 0),
         }
 
-        limit = 25
-        for item, base_url in urls.items():
-            data = []
-            offset = 0
-            item_single = item[:-1]
-            while True:
-                url = base_url.format(serverAlias, port, limit, offset)
-                log.debug('collect url: {}'.format(url))
-                response = yield agent.request('GET', url, Headers(headers))
-                response_body = yield readBody(response)
-                response_body = json.loads(response_body)
-                data.extend(response_body[item][item_single])
-                offset += limit
-                if len(data) >= response_body[item]['size'] or offset > response_body[item]['size']:
-                    break
-            results[item] = data
+        # Both listings are fetched in parallel, within the concurrency limit of the device
+        items = urls.keys()
+        data = yield gatherResults([client.get_paged_cached(urls[item], item, page_size, ttls[item], semaphore,
+                                                            self.fields[item], filters[item])
+                                    for item in items],
+                                   consumeErrors=True)
+        for item, (item_data, item_changed) in zip(items, data):
+            results[item] = item_data
+            changed = changed or item_changed
+
+        # Agents and deployment projects, listings that aren't paged, fetched in parallel. Components of a listing
+        # that fails are kept as they are.
+        optional = ('agents', 'deployments')
+        responses = yield DeferredList([semaphore.run(client.get_json_cached, self.optional_urls[item],
+                                                      ttls['projects'] if item == 'deployments' else 0)
+                                        for item in optional],
+                                       consumeErrors=True)
+        for item, (success, response) in zip(optional, responses):
+            if not success:
+                log.warning('{}: failed to get the Bamboo {} of {}: {}'.format(device.id, item, alias,
+                                                                               response.getErrorMessage()))
+                continue
+            results[item], item_changed = response
+            changed = changed or item_changed
 
+        results['changed'] = changed
         returnValue(results)
 
     def process(self, device, results, log):
@@ -100,83 +213,248 @@ class Bamboo(PythonPlugin):
             - A list of RelationshipMaps and ObjectMaps, both
         """
         # log.debug('Process results: {}'.format(results))
+        server_maps = []
         rm = []
-        if 'bamboo' in results:
-            rm.append(self.model_bamboo(results['bamboo'], log))
-            if 'projects' in results:
-                rm.append(self.model_projects(results['projects'], log))
-                project_keys = [p['key'] for p in results['projects']]
-                if 'plans' in results:
-                    rm.extend(self.model_plans(results['plans'], project_keys, log))
+        for server_id, server in sorted(results['servers'].items()):
+            server_maps.append(self.server_map(server_id, server['alias'], server['port'], server['results']))
+            if server['results'] is not None:
+                rm.extend(self.model_server(device, server_id, server['results'], log))
+                save_snapshot(get_state(device.id, server_id), client_for(device, (server['alias'], server['port'])),
+                              'zenmodeler', getattr(device, 'zBambooSnapshotMaxSize', 0), interval=0)
+        rm.insert(0, RelationshipMap(relname='bambooServers',
+                                     modname='ZenPacks.community.Bamboo.BambooServer',
+                                     compname='',
+                                     objmaps=server_maps))
         # log.debug('{}: process maps:{}'.format(device.id, rm))
         return rm
 
-    def model_bamboo(self, data, log):
+    def model_server(self, device, server_id, results, log):
+        rm = []
+        if 'agents' in results:
+            rm.append(self.model_agents(results['agents'], log, server_id))
+        if 'deployments' in results:
+            rm.extend(self.model_deployments(results['deployments'], log, server_id))
+        if 'projects' in results and 'plans' in results and getattr(device, 'zBambooDeltaModeling', False):
+            delta_maps = self.model_delta(device.id, results['projects'], results['plans'], log, server_id)
+            if delta_maps is not None:
+                rm.extend(delta_maps)
+                return rm
+        if 'projects' in results:
+            rm.append(self.model_projects(results['projects'], log, server_id))
+            project_keys = [p['key'] for p in results['projects']]
+            if 'plans' in results:
+                rm.extend(self.model_plans(results['plans'], project_keys, log, server_id))
+        return rm
+
+    def server_map(self, server_id, alias, port, results):
+        """
+        Return the ObjectMap of a server. When the server couldn't be modeled, the map only keeps the component.
+        """
         om_bamboo = ObjectMap()
-        om_bamboo.id = 'bamboo'
-        om_bamboo.title = 'Bamboo {}'.format(data['version'])
-        return RelationshipMap(relname='bambooServers',
-                               modname='ZenPacks.community.Bamboo.BambooServer',
-                               compname='',
-                               objmaps=[om_bamboo])
-
-    def model_projects(self, projects, log):
-        # TODO: Apply filters on projects ?
+        om_bamboo.id = server_id
+        if results is None:
+            return om_bamboo
+        version = results['bamboo']['version']
+        if server_id == DEFAULT_SERVER:
+            om_bamboo.title = 'Bamboo {}'.format(version)
+        else:
+            om_bamboo.title = 'Bamboo {} ({})'.format(version, alias)
+        om_bamboo.server_alias = alias
+        om_bamboo.server_port = port
+        return om_bamboo
+
+    def model_agents(self, agents, log, server_id=DEFAULT_SERVER):
+        log.debug('Agents: %d', len(agents))
+        return RelationshipMap(compname='bambooServers/{}'.format(server_id),
+                               relname='bambooAgents',
+                               modname='ZenPacks.community.Bamboo.BambooAgent',
+                               objmaps=[self.agent_map(agent) for agent in agents],
+                               )
+
+    def model_deployments(self, deployments, log, server_id=DEFAULT_SERVER):
+        """
+        Return the RelationshipMaps of the deployment projects of a server, then of the environments of each one.
+        """
+        log.debug('Deployment projects: %d', len(deployments))
+        server_compname = 'bambooServers/{}'.format(server_id)
+        project_maps = []
+        rm = []
+        for deployment in deployments:
+            om_deployment = self.deployment_map(deployment)
+            project_maps.append(om_deployment)
+            rm.append(RelationshipMap(compname='{}/bambooDeploymentProjects/{}'.format(server_compname,
+                                                                                       om_deployment.id),
+                                      relname='bambooEnvironments',
+                                      modname='ZenPacks.community.Bamboo.BambooEnvironment',
+                                      objmaps=[self.environment_map(environment, deployment)
+                                               for environment in deployment.get('environments') or []],
+                                      ))
+        rm.insert(0, RelationshipMap(compname=server_compname,
+                                     relname='bambooDeploymentProjects',
+                                     modname='ZenPacks.community.Bamboo.BambooDeploymentProject',
+                                     objmaps=project_maps,
+                                     ))
+        return rm
+
+    def model_projects(self, projects, log, server_id=DEFAULT_SERVER):
         project_maps = []
         for project in projects:
-            om_project = ObjectMap()
-            project_name = project['name']
-            project_key = project['key']
-            om_project.id = self.prepId(project_key)
-            om_project.title = '{} ({})'.format(project_name, project_key)
-            # om_project.key = project_key
-            om_project.desc = project.get('description', '')
-            om_project.project_key = project_key
-            plans = project.get('plans', {})
-            # log.debug('Project {} : Plans : {}'.format(project_name, plans['size']))
-            project_maps.append(om_project)
-        return RelationshipMap(compname='bambooServers/bamboo',
+            project_maps.append(self.project_map(project))
+        return RelationshipMap(compname='bambooServers/{}'.format(server_id),
                                relname='bambooProjects',
                                modname='ZenPacks.community.Bamboo.BambooProject',
                                objmaps=project_maps,
                                )
 
-    def model_plans(self, plans, project_keys, log):
-        # TODO: Apply filters on plans ?
-        log.debug('Plans: {}'.format(len(plans)))
-        log.debug('Plan: {}'.format(plans[0]))
-        log.debug('project_keys: {}'.format(project_keys))
-        rm = []
+    def model_plans(self, plans, project_keys, log, server_id=DEFAULT_SERVER):
+        log.debug('Plans: %d', len(plans))
+        log.debug('project_keys: %s', project_keys)
         start_time = time.time()
+
+        # Group the plans per project in a single pass
+        project_plans = dict((project_key, []) for project_key in project_keys)
+        for plan in plans:
+            plan_maps = project_plans.get(plan['projectKey'])
+            if plan_maps is None:
+                log.warning('Plan {} belongs to unknown project {}, skipped'.format(plan['key'], plan['projectKey']))
+                continue
+            plan_maps.append(self.plan_map(plan))
+
+        rm = []
         for project_key in project_keys:
-            compname = 'bambooServers/bamboo/bambooProjects/{}'.format(project_key)
-            plan_maps = []
-            plans_del = []
-            project_plans = []
-            # This method is faster than using a comprehension list and not editing the plans list.
-            for i, plan in enumerate(plans):
-                if plan['projectKey'] == project_key:
-                    project_plans.append(plan)
-                    plans_del.append(i)
-            for i in sorted(plans_del, reverse=True):
-                plans.pop(i)
-            for plan in project_plans:
-                om_plan = ObjectMap()
-                plan_key = plan['key']
-                plan_name = plan['name']
-                om_plan.id = self.prepId(plan_key)
-                om_plan.title = '{} ({})'.format(plan_name, plan_key)
-                om_plan.enabled = plan['enabled']
-                om_plan.type = plan['type']
-                om_plan.project_key = project_key
-                om_plan.plan_key = plan_key
-                plan_maps.append(om_plan)
-            rm.append(RelationshipMap(compname=compname,
+            rm.append(RelationshipMap(compname=project_compname((server_id, project_key)),
                                       relname='bambooPlans',
                                       modname='ZenPacks.community.Bamboo.BambooPlan',
-                                      objmaps=plan_maps,
+                                      objmaps=project_plans[project_key],
                                       ))
 
-        log.debug('timing: {}'.format(time.time() - start_time))
-        log.debug('model_plans rm: {}'.format(len(rm)))
+        log.debug('timing: %s', time.time() - start_time)
+        log.debug('model_plans rm: %d', len(rm))
         return rm
+
+    def project_map(self, project):
+        om_project = ObjectMap()
+        project_name = project['name']
+        project_key = project['key']
+        om_project.id = component_id(project_key)
+        om_project.title = '{} ({})'.format(project_name, project_key)
+        om_project.desc = project.get('description', '')
+        om_project.project_key = project_key
+        return om_project
+
+    def plan_map(self, plan):
+        om_plan = ObjectMap()
+        plan_key = plan['key']
+        plan_name = plan['name']
+        om_plan.id = component_id(plan_key)
+        om_plan.title = '{} ({})'.format(plan_name, plan_key)
+        om_plan.enabled = plan['enabled']
+        om_plan.type = plan['type']
+        om_plan.project_key = plan['projectKey']
+        om_plan.plan_key = plan_key
+        return om_plan
+
+    def agent_map(self, agent):
+        om_agent = ObjectMap()
+        agent_id = str(agent['id'])
+        om_agent.id = component_id('agent_{}'.format(agent_id))
+        om_agent.title = agent.get('name') or agent_id
+        om_agent.agent_id = agent_id
+        om_agent.agent_type = agent.get('type', '')
+        om_agent.enabled = agent.get('enabled', True)
+        return om_agent
+
+    def deployment_map(self, deployment):
+        om_deployment = ObjectMap()
+        deployment_id = str(deployment['id'])
+        om_deployment.id = component_id('deployment_{}'.format(deployment_id))
+        om_deployment.title = deployment.get('name') or deployment_id
+        om_deployment.desc = deployment.get('description', '')
+        om_deployment.deployment_id = deployment_id
+        om_deployment.plan_key = (deployment.get('planKey') or {}).get('key', '')
+        return om_deployment
+
+    def environment_map(self, environment, deployment):
+        om_environment = ObjectMap()
+        environment_id = str(environment['id'])
+        om_environment.id = component_id('environment_{}'.format(environment_id))
+        om_environment.title = environment.get('name') or environment_id
+        om_environment.desc = environment.get('description', '')
+        om_environment.environment_id = environment_id
+        om_environment.deployment_id = str(deployment['id'])
+        om_environment.position = environment.get('position', 0)
+        return om_environment
+
+    def model_delta(self, device_id, projects, plans, log, server_id=DEFAULT_SERVER):
+        """
+        Return incremental ObjectMaps for the projects and plans added, removed or changed since the previous model
+        of the device. Returns None when there is no previous model to compare to, full maps are then required.
+        """
+        state = get_state(device_id, server_id)
+        previous = state.model_fingerprints
+        current_projects = dict((p['key'], (self.fingerprint(p['key'], p['name'], p.get('description', '')), p))
+                                for p in projects)
+        current_plans = dict((p['key'], (self.fingerprint(p['key'], p['name'], p['enabled'], p['type'],
+                                                          p['projectKey']), p))
+                             for p in plans if p['projectKey'] in current_projects)
+        state.model_fingerprints = {
+            'projects': dict((key, value[0]) for key, value in current_projects.items()),
+            'plans': dict((key, (value[0], value[1]['projectKey'])) for key, value in current_plans.items()),
+        }
+        if state.model_fingerprints != previous:
+            state.dirty = True
+        if previous is None:
+            return None
+
+        maps = []
+        server_compname = 'bambooServers/{}'.format(server_id)
+        for project_key, (fingerprint, project) in current_projects.items():
+            if previous['projects'].get(project_key) == fingerprint:
+                continue
+            om_project = self.project_map(project)
+            self.incremental(om_project, server_compname, 'bambooProjects', 'ZenPacks.community.Bamboo.BambooProject')
+            om_project._add = project_key not in previous['projects']
+            maps.append(om_project)
+        for project_key in previous['projects']:
+            if project_key not in current_projects:
+                om_project = ObjectMap({'id': component_id(project_key)})
+                self.incremental(om_project, server_compname, 'bambooProjects',
+                                 'ZenPacks.community.Bamboo.BambooProject')
+                om_project._remove = True
+                maps.append(om_project)
+
+        for plan_key, (fingerprint, plan) in current_plans.items():
+            previous_plan = previous['plans'].get(plan_key)
+            if previous_plan is not None and previous_plan[0] == fingerprint:
+                continue
+            om_plan = self.plan_map(plan)
+            self.incremental(om_plan, project_compname((server_id, plan['projectKey'])), 'bambooPlans',
+                             'ZenPacks.community.Bamboo.BambooPlan')
+            om_plan._add = previous_plan is None or previous_plan[1] != plan['projectKey']
+            maps.append(om_plan)
+        for plan_key, (_, project_key) in previous['plans'].items():
+            current_plan = current_plans.get(plan_key)
+            # Plans of removed projects go away with their project
+            if project_key not in current_projects:
+                continue
+            if current_plan is None or current_plan[1]['projectKey'] != project_key:
+                om_plan = ObjectMap({'id': component_id(plan_key)})
+                self.incremental(om_plan, project_compname((server_id, project_key)), 'bambooPlans',
+                                 'ZenPacks.community.Bamboo.BambooPlan')
+                om_plan._remove = True
+                maps.append(om_plan)
+
+        log.info('{}: delta modeling, {} changed projects and plans'.format(device_id, len(maps)))
+        return maps
+
+    @staticmethod
+    def fingerprint(*fields):
+        """
+        Return a digest of fields. Unlike hash(), it is the same in every process, so it can be kept in the snapshot.
+        """
+        return hashlib.sha1(u'\0'.join(u'{}'.format(field) for field in fields).encode('utf-8')).hexdigest()
+
+    def incremental(self, om, compname, relname, modname):
+        om.compname = compname
+        om.relname = relname
+        om.modname = modname
@@ -0,0 +1,188 @@
+
+# stdlib Imports
+import time
+
+# Number of projects and of plans per project
+SIZES = {
+    'small': (10, 10),
+    'medium': (50, 20),
+    'large': (100, 100),
+}
+# Number of agents of the server
+AGENT_COUNT = 50
+# Attributes of the build results kept by the collector
+RECORD_FIELDS = ('buildNumber', 'buildDuration', 'buildState', 'lifeCycleState', 'buildCompletedTime',
+                 'buildStartedTime', 'queueStartedTime')
+
+
+def bamboo_time(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(timestamp))
+
+
+class BambooFixture(object):
+    """
+    Synthetic content of a Bamboo server: projects, plans, their build results and agents.
+
+    The entries carry the same attributes as the ones returned by Bamboo, so that the responses have a realistic
+    size. The content is deterministic for a given size.
+    """
+
+    def __init__(self, size):
+        project_count, plans_per_project = SIZES[size]
+        self.started = int(time.time()) - 86400
+        self.projects = []
+        self.plans = []
+        self.build_numbers = {}
+        for p in range(project_count):
+            project_key = 'PRJ{}'.format(p)
+            self.projects.append(self.project(project_key, p))
+            for n in range(plans_per_project):
+                plan_key = '{}-PLAN{}'.format(project_key, n)
+                self.plans.append(self.plan(project_key, plan_key, n))
+                self.build_numbers[plan_key] = 1 + (p * plans_per_project + n) % 50
+        self.agents = [self.agent(a) for a in range(AGENT_COUNT)]
+        self._latest_results = None
+
+    def advance(self, count=1):
+        """
+        Complete count new builds of every plan.
+        """
+        for plan_key in self.build_numbers:
+            self.build_numbers[plan_key] += count
+        self._latest_results = None
+
+    def link(self, path):
+        return {'href': 'https://bamboo.example.com/rest/api/latest{}'.format(path), 'rel': 'self'}
+
+    def project(self, project_key, index):
+        return {
+            'key': project_key,
+            'name': 'Project {}'.format(index),
+            'description': 'Synthetic project {}'.format(index),
+            'link': self.link('/project/{}'.format(project_key)),
+        }
+
+    def plan(self, project_key, plan_key, index):
+        return {
+            'shortName': 'Plan {}'.format(index),
+            'shortKey': 'PLAN{}'.format(index),
+            'type': 'chain',
+            'enabled': index % 10 != 9,
+            'link': self.link('/plan/{}'.format(plan_key)),
+            'key': plan_key,
+            'name': '{} - Plan {}'.format(project_key, index),
+            'planKey': {'key': plan_key},
+            'projectKey': project_key,
+            'projectName': 'Project {}'.format(project_key),
+            'description': '',
+            'isFavourite': False,
+            'isActive': False,
+            'isBuilding': False,
+            'averageBuildTimeInSeconds': 120 + index,
+            'actions': {'size': 3, 'start-index': 0, 'max-result': 3},
+            'stages': {'size': 1, 'start-index': 0, 'max-result': 1},
+            'branches': {'size': 0, 'start-index': 0, 'max-result': 0},
+        }
+
+    def result(self, plan_key, number):
+        completed = self.started + number * 600
+        duration = 60000 + (number * 7919) % 240000
+        successful = number % 7 != 0
+        return {
+            'link': self.link('/result/{}-{}'.format(plan_key, number)),
+            'plan': {
+                'shortName': plan_key.split('-')[1],
+                'shortKey': plan_key.split('-')[1],
+                'type': 'chain',
+                'enabled': True,
+                'link': self.link('/plan/{}'.format(plan_key)),
+                'key': plan_key,
+                'name': plan_key,
+                'planKey': {'key': plan_key},
+            },
+            'planName': plan_key,
+            'projectName': plan_key.split('-')[0],
+            'buildResultKey': '{}-{}'.format(plan_key, number),
+            'lifeCycleState': 'Finished',
+            'id': number,
+            'queueStartedTime': bamboo_time(completed - duration / 1000 - 30),
+            'buildStartedTime': bamboo_time(completed - duration / 1000),
+            'prettyBuildStartedTime': 'Mon, 1 Jan, 12:00 AM',
+            'buildCompletedTime': bamboo_time(completed),
+            'buildCompletedDate': bamboo_time(completed),
+            'prettyBuildCompletedTime': 'Mon, 1 Jan, 12:05 AM',
+            'buildDurationInSeconds': duration / 1000,
+            'buildDuration': duration,
+            'buildDurationDescription': '{} minutes'.format(duration / 60000),
+            'buildRelativeTime': '1 hour ago',
+            'vcsRevisionKey': '{:040x}'.format(number),
+            'buildTestSummary': '{} passed'.format(number % 100),
+            'successfulTestCount': number % 100,
+            'failedTestCount': 0 if successful else 1,
+            'quarantinedTestCount': 0,
+            'skippedTestCount': 0,
+            'continuable': False,
+            'onceOff': False,
+            'restartable': False,
+            'notRunYet': False,
+            'finished': True,
+            'successful': successful,
+            'buildReason': 'Changes by <a href="https://bamboo.example.com/browse/user/dev">Developer</a>',
+            'reasonSummary': 'Changes by Developer',
+            'key': '{}-{}'.format(plan_key, number),
+            'planResultKey': {'key': '{}-{}'.format(plan_key, number), 'resultNumber': number},
+            'state': 'Successful' if successful else 'Failed',
+            'buildState': 'Successful' if successful else 'Failed',
+            'number': number,
+            'buildNumber': number,
+        }
+
+    def agent(self, index):
+        return {
+            'id': 131073 + index,
+            'name': 'agent-{}'.format(index),
+            'type': 'REMOTE',
+            'active': index % 10 != 0,
+            'enabled': True,
+            'busy': index % 3 == 0,
+        }
+
+    def latest_results(self):
+        if self._latest_results is None:
+            self._latest_results = [self.result(plan['key'], self.build_numbers[plan['key']]) for plan in self.plans]
+        return self._latest_results
+
+    def plan_results(self, plan_key, count):
+        last = self.build_numbers[plan_key]
+        return [self.result(plan_key, number) for number in range(last, max(last - count, 0), -1)]
+
+    def build_records(self, count):
+        """
+        Return count completed builds spread over the plans, as {plan_key: [build, ...]}, with only the attributes
+        kept by the collector.
+        """
+        per_plan = max(count // len(self.plans), 1)
+        self.advance(per_plan)
+        records = {}
+        for plan in self.plans:
+            builds = records[plan['key']] = []
+            for result in self.plan_results(plan['key'], per_plan):
+                record = dict((name, result[name]) for name in RECORD_FIELDS)
+                record['plan'] = {'key': plan['key']}
+                builds.append(record)
+        return records
+
+
+def listing(item, entries, start=0, max_result=25):
+    """
+    Return a page of a Bamboo listing, e.g. {"plans": {"size": 3, "start-index": 0, "max-result": 25, "plan": []}}.
+    """
+    return {
+        item: {
+            'size': len(entries),
+            'expand': item[:-1],
+            'start-index': start,
+            'max-result': max_result,
+            item[:-1]: entries[start:start + max_result],
+        },
+    }
@@ -0,0 +1,340 @@
+
+"""
+Benchmarks of the Bamboo modeler and of the build results collector, against a stand-in Bamboo server.
+
+    python -m ZenPacks.community.Bamboo.tests.benchmark.run --output current.json --compare baseline.json
+
+Every scenario runs in its own process, so that its peak memory is measured on its own. The stand-in server runs in
+yet another process, see server.py. The scenarios are:
+
+    modeling    Bamboo.collect and Bamboo.process, including model_plans
+    poll        first cycle of BambooProject: collect and onSuccess, with an empty high-water mark
+    poll_warm   second cycle of BambooProject, after every plan completed one more build
+    onsuccess   BambooProject.onSuccess alone, over BUILD_RECORDS build results spread over the plans
+    plan_status one cycle of BambooPlanStatus: collect and onSuccess, after a first cycle of BambooProject
+
+Results are written as JSON. With --compare, they are checked against a previous run, and the exit status is 1 when
+the wall time, the request count or the peak memory of a scenario grew beyond the tolerance.
+"""
+
+# stdlib Imports
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from Products.ZenUtils.Utils import prepId
+from ZenPacks.community.Bamboo.dsplugins.BambooPlanStatus import BambooPlanStatus
+from ZenPacks.community.Bamboo.dsplugins.BambooProject import BambooProject
+from ZenPacks.community.Bamboo.lib.client import client_for
+from ZenPacks.community.Bamboo.modeler.plugins.community.json.Bamboo import Bamboo
+from ZenPacks.community.Bamboo.tests.benchmark.fixtures import BambooFixture, SIZES
+
+# Twisted Imports
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, maybeDeferred, returnValue
+from twisted.python.failure import Failure
+from twisted.web.client import Agent
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.benchmark')
+
+SCENARIOS = ('modeling', 'poll', 'poll_warm', 'onsuccess', 'plan_status')
+# Number of build results processed by the onsuccess scenario
+BUILD_RECORDS = 50000
+# Compared between two runs, with the slack allowed on top of the tolerance
+COMPARED = (
+    ('wall_time', 0.05),
+    ('requests', 0),
+    ('peak_rss_delta_kb', 1024),
+)
+RUN_MODULE = 'ZenPacks.community.Bamboo.tests.benchmark.run'
+SERVER_MODULE = 'ZenPacks.community.Bamboo.tests.benchmark.server'
+
+
+class Namespace(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def device_config(port):
+    return Namespace(
+        id='benchmark',
+        zBambooServerAlias='127.0.0.1',
+        zBambooServerAliases=[],
+        zBambooPort=port,
+        zBambooUsername='admin',
+        zBambooPassword='admin',
+        zBambooRequestTimeout=300,
+        zBambooPageSize=25,
+        zBambooMaxConcurrentRequests=4,
+        zBambooInfoCacheTTL=0,
+        zBambooProjectsCacheTTL=0,
+        zBambooPlansCacheTTL=0,
+        zBambooDeltaModeling=False,
+        zBambooWebhookPort=0,
+        zBambooWebhookInterface='127.0.0.1',
+        zBambooWebhookToken='',
+        zBambooWebhookPollInterval=3600,
+        zBambooAdaptivePolling=False,
+        zBambooMinInterval=60,
+        zBambooMaxInterval=1800,
+        zBambooRateLimit=0,
+        zBambooBreakerThreshold=5,
+        zBambooBreakerCooldown=300,
+        zBambooAnomalyZScore=3,
+        zBambooSnapshotMaxSize=0,
+        zBambooPhaseSpread=0,
+    )
+
+
+def benchmark_client(device):
+    client = client_for(device)
+    # The stand-in server doesn't use TLS
+    client.base_url = 'http://127.0.0.1:{}/rest/api/latest'.format(device.zBambooPort)
+    return client
+
+
+def peak_rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@inlineCallbacks
+def modeling(port):
+    device = device_config(port)
+    client = benchmark_client(device)
+    plugin = Bamboo()
+    start = time.time()
+    results = yield plugin.collect(device, log)
+    collect_time = time.time() - start
+    start = time.time()
+    maps = plugin.process(device, results, log)
+    process_time = time.time() - start
+    returnValue({
+        'collect_time': collect_time,
+        'process_time': process_time,
+        'wall_time': collect_time + process_time,
+        'requests': client.stats.requests,
+        'bytes_received': client.stats.bytes_received,
+        'parse_time': client.stats.parse_time,
+        'components': sum(len(getattr(m, 'maps', [m])) for m in maps),
+    })
+
+
+def plans_config(device, size):
+    config = Namespace(id=device.id, datasources=[])
+    for plan in BambooFixture(size).plans:
+        datasource = Namespace(datasource='bamboo_build_plan', component=prepId(plan['key']), cycletime=300,
+                               params={'project_key': plan['projectKey'], 'plan_key': plan['key']},
+                               **device.__dict__)
+        config.datasources.append(datasource)
+    return config
+
+
+@inlineCallbacks
+def poll(port, size, warm=False):
+    device = device_config(port)
+    client = benchmark_client(device)
+    config = plans_config(device, size)
+    plugin = BambooProject()
+    if warm:
+        result = yield plugin.collect(config)
+        plugin.onSuccess(result, config)
+        yield Agent(reactor).request(b'POST', 'http://127.0.0.1:{}/benchmark/advance'.format(port).encode())
+        client.stats.reset()
+    start = time.time()
+    result = yield plugin.collect(config)
+    collect_time = time.time() - start
+    start = time.time()
+    data = plugin.onSuccess(result, config)
+    onsuccess_time = time.time() - start
+    returnValue({
+        'collect_time': collect_time,
+        'onsuccess_time': onsuccess_time,
+        'wall_time': collect_time + onsuccess_time,
+        'requests': client.stats.requests,
+        'bytes_received': client.stats.bytes_received,
+        'parse_time': client.stats.parse_time,
+        'components': len(data['values']),
+    })
+
+
+@inlineCallbacks
+def plan_status(port, size):
+    device = device_config(port)
+    client = benchmark_client(device)
+    config = plans_config(device, size)
+    # The latest builds are read by the BambooProject task
+    project_plugin = BambooProject()
+    result = yield project_plugin.collect(config)
+    project_plugin.onSuccess(result, config)
+    client.stats.reset()
+    plugin = BambooPlanStatus()
+    start = time.time()
+    result = yield plugin.collect(config)
+    collect_time = time.time() - start
+    start = time.time()
+    data = plugin.onSuccess(result, config)
+    onsuccess_time = time.time() - start
+    returnValue({
+        'collect_time': collect_time,
+        'onsuccess_time': onsuccess_time,
+        'wall_time': collect_time + onsuccess_time,
+        'requests': client.stats.requests,
+        'bytes_received': client.stats.bytes_received,
+        'parse_time': client.stats.parse_time,
+        'components': len(data['values']),
+    })
+
+
+def onsuccess(port, size):
+    device = device_config(port)
+    client = benchmark_client(device)
+    config = plans_config(device, size)
+    result = {'builds': BambooFixture(size).build_records(BUILD_RECORDS)}
+    plugin = BambooProject()
+    start = time.time()
+    data = plugin.onSuccess(result, config)
+    onsuccess_time = time.time() - start
+    return {
+        'onsuccess_time': onsuccess_time,
+        'wall_time': onsuccess_time,
+        'requests': client.stats.requests,
+        'builds': sum(len(builds) for builds in result['builds'].values()),
+        'components': len(data['values']),
+    }
+
+
+def run_scenario(scenario, size, port):
+    """
+    Run a scenario in this process, and return its measures.
+    """
+    rss_before = peak_rss()
+    outcome = []
+
+    def done(result):
+        outcome.append(result)
+        reactor.stop()
+
+    def start():
+        if scenario == 'modeling':
+            d = modeling(port)
+        elif scenario == 'onsuccess':
+            d = maybeDeferred(onsuccess, port, size)
+        elif scenario == 'plan_status':
+            d = plan_status(port, size)
+        else:
+            d = poll(port, size, warm=scenario == 'poll_warm')
+        d.addBoth(done)
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+    if isinstance(outcome[0], Failure):
+        outcome[0].raiseException()
+    measures = outcome[0]
+    measures['peak_rss_kb'] = peak_rss()
+    measures['peak_rss_delta_kb'] = measures['peak_rss_kb'] - rss_before
+    return measures
+
+
+def start_server(size):
+    server = subprocess.Popen([sys.executable, '-m', SERVER_MODULE, '--size', size], stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+    return server, port
+
+
+def run_all(sizes):
+    results = []
+    for size in sizes:
+        server, port = start_server(size)
+        try:
+            for scenario in SCENARIOS:
+                output = subprocess.check_output([sys.executable, '-m', RUN_MODULE, '--child', scenario,
+                                                  '--size', size, '--port', str(port)])
+                measures = json.loads(output.splitlines()[-1])
+                measures.update({
+                    'scenario': scenario,
+                    'size': size,
+                    'plans': SIZES[size][0] * SIZES[size][1],
+                })
+                results.append(measures)
+                log.info('{} {}: {:.3f}s, {} requests, {} KB'.format(size, scenario, measures['wall_time'],
+                                                                     measures['requests'],
+                                                                     measures['peak_rss_delta_kb']))
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the regressions of results against the results of baseline, as a list of messages.
+    """
+    previous = dict(((r['scenario'], r['size']), r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['size']))
+        if before is None:
+            continue
+        for name, slack in COMPARED:
+            if name not in before:
+                continue
+            limit = before[name] * (1 + tolerance) + slack
+            if result[name] > limit:
+                regressions.append('{} {}: {} went from {} to {}'.format(result['size'], result['scenario'], name,
+                                                                         before[name], result[name]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the Bamboo modeler and collectors')
+    parser.add_argument('--sizes', default='small,medium,large',
+                        help='Comma-separated sizes among {}'.format(', '.join(sorted(SIZES))))
+    parser.add_argument('--output', default='bamboo-benchmark.json', help='JSON file the results are written to')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Growth allowed before a regression, 0.2 = 20%%')
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--size', choices=sorted(SIZES), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.child:
+        logging.basicConfig(level=logging.ERROR)
+        sys.stdout.write('{}\n'.format(json.dumps(run_scenario(options.child, options.size, options.port))))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sizes = [size for size in options.sizes.split(',') if size]
+    results = run_all(sizes)
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(options.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    log.info('Results written to {}'.format(os.path.abspath(options.output)))
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, options.tolerance)
+        for regression in regressions:
+            log.error('Regression: {}'.format(regression))
+        if regressions:
+            return 1
+        log.info('No regression against {}'.format(options.compare))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+
+# stdlib Imports
+import argparse
+import json
+import logging
+import sys
+
+from ZenPacks.community.Bamboo.tests.benchmark.fixtures import BambooFixture, SIZES, listing
+
+# Twisted Imports
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+# Setup logging
+log = logging.getLogger('zen.Bamboo.benchmark')
+
+API_PREFIX = '/rest/api/latest'
+
+
+def text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) and not isinstance(value, str) else value
+
+
+class BambooStandIn(Resource):
+    """
+    Serve the REST API of a Bamboo server from a BambooFixture, over plain HTTP.
+
+    Responses are encoded once per URL, until the fixture is advanced with a POST on /benchmark/advance, so that the
+    cost of the stand-in stays out of the measures as much as possible.
+    """
+
+    isLeaf = True
+
+    def __init__(self, fixture):
+        Resource.__init__(self)
+        self.fixture = fixture
+        self.responses = {}
+        self.requests = 0
+
+    def render_GET(self, request):
+        self.requests += 1
+        uri = text(request.uri)
+        body = self.responses.get(uri)
+        if body is None:
+            data = self.route(text(request.path), dict((text(k), text(v[0])) for k, v in request.args.items()))
+            if data is None:
+                request.setResponseCode(404)
+                return b''
+            body = self.responses[uri] = json.dumps(data).encode('utf-8')
+        request.setHeader(b'content-type', b'application/json')
+        return body
+
+    def render_POST(self, request):
+        if text(request.path) != '/benchmark/advance':
+            request.setResponseCode(404)
+            return b''
+        self.fixture.advance()
+        self.responses.clear()
+        return b''
+
+    def route(self, path, args):
+        if not path.startswith(API_PREFIX):
+            return None
+        path = path[len(API_PREFIX):].rstrip('/')
+        start = int(args.get('start-index', 0))
+        max_result = int(args.get('max-result', 25))
+        if path == '/info':
+            return {'version': '6.8.0', 'edition': '', 'buildDate': '2019-01-01T00:00:00.000Z',
+                    'buildNumber': '60805', 'state': 'RUNNING'}
+        if path == '/queue':
+            return {'queuedBuilds': {'size': 0, 'start-index': 0, 'max-result': 0}}
+        if path == '/agent':
+            return self.fixture.agents
+        if path == '/project':
+            return listing('projects', self.fixture.projects, start, max_result)
+        if path == '/plan':
+            return listing('plans', self.fixture.plans, start, max_result)
+        if path == '/result':
+            return listing('results', self.fixture.latest_results(), start, max_result)
+        if path.startswith('/result/'):
+            plan_key = path[len('/result/'):]
+            if plan_key not in self.fixture.build_numbers:
+                return None
+            return listing('results', self.fixture.plan_results(plan_key, max_result), start, max_result)
+        return None
+
+
+def listen(size, port=0):
+    """
+    Start a stand-in server for a fixture of the given size, and return its listening port.
+    """
+    return reactor.listenTCP(port, Site(BambooStandIn(BambooFixture(size))), interface='127.0.0.1')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stand-in Bamboo server for the benchmarks')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--port', type=int, default=0)
+    options = parser.parse_args(argv)
+
+    port = listen(options.size, options.port)
+    # The benchmark runner reads the port on the first line
+    sys.stdout.write('{}\n'.format(port.getHost().port))
+    sys.stdout.flush()
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
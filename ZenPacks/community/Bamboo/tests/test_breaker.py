@@ -0,0 +1,91 @@
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.lib.breaker import CircuitBreaker, TokenBucket
+
+
+class TestTokenBucket(BaseTestCase):
+
+    def test_disabled(self):
+        bucket = TokenBucket(0)
+        for _ in range(100):
+            self.assertEqual(bucket.reserve(1000), 0)
+
+    def test_rate(self):
+        bucket = TokenBucket(2, burst=2)
+        bucket.updated = 1000
+        self.assertEqual(bucket.reserve(1000), 0)
+        self.assertEqual(bucket.reserve(1000), 0)
+        # Tokens are reserved ahead: each request waits for the previous one
+        self.assertAlmostEqual(bucket.reserve(1000), 0.5)
+        self.assertAlmostEqual(bucket.reserve(1000), 1.0)
+        # Refilled up to the burst size
+        self.assertEqual(bucket.reserve(1010), 0)
+        self.assertEqual(bucket.reserve(1010), 0)
+        self.assertAlmostEqual(bucket.reserve(1010), 0.5)
+
+
+class TestCircuitBreaker(BaseTestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker('bamboo:443', threshold=3, cooldown=300)
+        for _ in range(2):
+            breaker.failure(1000)
+        self.assertTrue(breaker.allow(1000))
+        breaker.failure(1000)
+        self.assertTrue(breaker.is_open(1000))
+        self.assertFalse(breaker.allow(1100))
+        self.assertEqual(breaker.remaining(1100), 200)
+
+    def test_success_resets(self):
+        breaker = CircuitBreaker('bamboo:443', threshold=3, cooldown=300)
+        breaker.failure(1000)
+        breaker.failure(1000)
+        breaker.success()
+        breaker.failure(1000)
+        breaker.failure(1000)
+        self.assertFalse(breaker.is_open(1000))
+
+    def test_disabled(self):
+        breaker = CircuitBreaker('bamboo:443', threshold=0, cooldown=300)
+        for _ in range(10):
+            breaker.failure(1000)
+        self.assertFalse(breaker.is_open(1000))
+        self.assertTrue(breaker.allow(1000))
+        # Disabling an open breaker closes it
+        breaker.configure(1, 300)
+        breaker.failure(1000)
+        self.assertFalse(breaker.allow(1000))
+        breaker.configure(0, 300)
+        self.assertTrue(breaker.allow(1000))
+
+    def test_half_open(self):
+        breaker = CircuitBreaker('bamboo:443', threshold=1, cooldown=300)
+        breaker.failure(1000)
+        self.assertFalse(breaker.allow(1299))
+        # After the cooldown, a failure of the probe opens the breaker again
+        self.assertTrue(breaker.allow(1300))
+        breaker.failure(1300)
+        self.assertFalse(breaker.allow(1301))
+        self.assertTrue(breaker.allow(1600))
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow(1601))
+
+    def test_single_probe(self):
+        breaker = CircuitBreaker('bamboo:443', threshold=1, cooldown=300)
+        breaker.failure(1000)
+        # Only one request goes through while the probe is in flight
+        self.assertTrue(breaker.allow(1300))
+        self.assertFalse(breaker.allow(1300))
+        self.assertTrue(breaker.is_open(1300))
+        breaker.success()
+        self.assertTrue(breaker.allow(1301))
+        self.assertTrue(breaker.allow(1301))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestTokenBucket))
+    suite.addTest(makeSuite(TestCircuitBreaker))
+    return suite
@@ -0,0 +1,36 @@
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.lib.stats import build_metrics
+
+
+class TestBuildMetrics(BaseTestCase):
+
+    def test_empty(self):
+        self.assertEqual(build_metrics([], 10000), {})
+
+    def test_metrics(self):
+        now = 100000
+        # (completed, duration, queue_wait, successful)
+        builds = [(now - 7200 + 60 * n, 10.0 * (n + 1), None if n % 2 else float(n), n % 4 != 3) for n in range(10)]
+        builds += [(now - 600, 200.0, 30.0, True), (now - 60, 300.0, 60.0, False)]
+        values = build_metrics(builds, now)
+
+        self.assertEqual(values['duration_p50'], 60.0)
+        self.assertEqual(values['duration_p90'], 200.0)
+        self.assertEqual(values['duration_max'], 300.0)
+        self.assertEqual(values['queue_wait_p50'], 6.0)
+        self.assertEqual(values['queue_wait_p90'], 60.0)
+        self.assertAlmostEqual(values['success_ratio'], 100.0 * 9 / 12)
+        self.assertEqual(values['builds_per_hour'], 2)
+
+    def test_unknown_queue_wait(self):
+        values = build_metrics([(1000, 10.0, None, True)], 2000)
+        self.assertNotIn('queue_wait_p50', values)
+        self.assertEqual(values['success_ratio'], 100.0)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestBuildMetrics))
+    return suite
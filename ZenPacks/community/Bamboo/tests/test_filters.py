@@ -0,0 +1,46 @@
+import json
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.lib.filters import ItemFilter
+from ZenPacks.community.Bamboo.lib.stream import JsonItemParser
+
+PLANS = [
+    {'key': 'PRJ-BUILD', 'name': 'Build', 'enabled': True, 'type': 'chain', 'projectKey': 'PRJ'},
+    {'key': 'PRJ-OLD', 'name': 'Old', 'enabled': False, 'type': 'chain', 'projectKey': 'PRJ'},
+    {'key': 'PRJ-SANDBOX1', 'name': 'Sandbox', 'enabled': True, 'type': 'chain', 'projectKey': 'PRJ'},
+    {'key': 'ARCH-BUILD', 'name': 'Archive', 'enabled': True, 'type': 'chain', 'projectKey': 'ARCH'},
+]
+
+
+class TestItemFilter(BaseTestCase):
+
+    def test_empty(self):
+        keep = ItemFilter()
+        self.assertTrue(all(keep(plan) for plan in PLANS))
+
+    def test_plans(self):
+        projects = ItemFilter(exclude='^ARCH$')
+        keep = ItemFilter(exclude='SANDBOX', skip_disabled=True, parent=projects)
+        self.assertEqual([plan['key'] for plan in PLANS if keep(plan)], ['PRJ-BUILD'])
+
+    def test_include(self):
+        keep = ItemFilter(include='^PRJ-(BUILD|OLD)$')
+        self.assertEqual([plan['key'] for plan in PLANS if keep(plan)], ['PRJ-BUILD', 'PRJ-OLD'])
+
+    def test_streamed(self):
+        document = json.dumps({'plans': {'size': 4, 'max-result': 25, 'plan': PLANS}})
+        parser = JsonItemParser(('plans', 'plan'), ('key',), ItemFilter(skip_disabled=True))
+        for n in range(0, len(document), 7):
+            parser.feed(document[n:n + 7])
+        self.assertEqual(parser.items, [{'key': 'PRJ-BUILD'}, {'key': 'PRJ-SANDBOX1'}, {'key': 'ARCH-BUILD'}])
+        self.assertEqual(parser.count, 4)
+        self.assertEqual(parser.skipped, 1)
+        self.assertEqual(parser.attributes['size'], 4)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestItemFilter))
+    return suite
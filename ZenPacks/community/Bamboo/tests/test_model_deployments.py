@@ -0,0 +1,56 @@
+import logging
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.modeler.plugins.community.json.Bamboo import Bamboo
+
+log = logging.getLogger('zen.Bamboo.tests')
+
+DEPLOYMENTS = [
+    {
+        'id': 1179649,
+        'name': 'Web Application',
+        'description': '',
+        'planKey': {'key': 'PRJ-BUILD'},
+        'environments': [
+            {'id': 1245185, 'name': 'Staging', 'description': 'Staging servers', 'position': 0},
+            {'id': 1245186, 'name': 'Production', 'description': '', 'position': 1},
+        ],
+    },
+    {
+        'id': 1179650,
+        'name': 'Empty',
+        'planKey': {'key': 'PRJ-TEST'},
+        'environments': [],
+    },
+]
+
+
+class TestModelDeployments(BaseTestCase):
+
+    def afterSetUp(self):
+        self.plugin = Bamboo()
+
+    def test_maps(self):
+        rm = self.plugin.model_deployments(DEPLOYMENTS, log, 'bamboo')
+        self.assertEqual(len(rm), 3)
+
+        self.assertEqual(rm[0].compname, 'bambooServers/bamboo')
+        self.assertEqual(rm[0].relname, 'bambooDeploymentProjects')
+        self.assertEqual([om.id for om in rm[0].maps], ['deployment_1179649', 'deployment_1179650'])
+        self.assertEqual(rm[0].maps[0].plan_key, 'PRJ-BUILD')
+
+        self.assertEqual(rm[1].compname, 'bambooServers/bamboo/bambooDeploymentProjects/deployment_1179649')
+        self.assertEqual(rm[1].relname, 'bambooEnvironments')
+        self.assertEqual([om.title for om in rm[1].maps], ['Staging', 'Production'])
+        self.assertEqual(rm[1].maps[1].environment_id, '1245186')
+        self.assertEqual(rm[1].maps[1].deployment_id, '1179649')
+        # Environments removed from a deployment project are removed from the model
+        self.assertEqual(len(rm[2].maps), 0)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestModelDeployments))
+    return suite
@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import time
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.lib.state import get_state
+from ZenPacks.community.Bamboo.modeler.plugins.community.json.Bamboo import Bamboo
+
+log = logging.getLogger('zen.Bamboo.tests')
+
+
+def make_plans(project_count, plans_per_project):
+    project_keys = ['PRJ{}'.format(p) for p in range(project_count)]
+    plans = []
+    for project_key in project_keys:
+        for n in range(plans_per_project):
+            plans.append({
+                'key': '{}-PLAN{}'.format(project_key, n),
+                'name': 'Plan {}'.format(n),
+                'enabled': True,
+                'type': 'chain',
+                'projectKey': project_key,
+            })
+    return project_keys, plans
+
+
+class TestModelPlans(BaseTestCase):
+
+    def afterSetUp(self):
+        self.plugin = Bamboo()
+
+    def test_grouping(self):
+        project_keys, plans = make_plans(3, 4)
+        plans.append({'key': 'ORPHAN-PLAN', 'name': 'Orphan', 'enabled': True, 'type': 'chain',
+                      'projectKey': 'ORPHAN'})
+        rm = self.plugin.model_plans(plans, project_keys, log)
+
+        self.assertEqual(len(rm), 3)
+        for project_key, relmap in zip(project_keys, rm):
+            self.assertEqual(relmap.compname, 'bambooServers/bamboo/bambooProjects/{}'.format(project_key))
+            self.assertEqual(len(relmap.maps), 4)
+            for om in relmap.maps:
+                self.assertEqual(om.project_key, project_key)
+
+    def test_linear_time(self):
+        """Modeling 10k plans / 500 projects takes about 10 times as long as 1k plans / 50 projects."""
+        timings = []
+        for project_count in (50, 500):
+            project_keys, plans = make_plans(project_count, 20)
+            start = time.time()
+            self.plugin.model_plans(plans, project_keys, log)
+            timings.append(time.time() - start)
+
+        # A quadratic implementation would be about 100 times slower
+        self.assertLess(timings[1], max(timings[0], 0.01) * 30)
+
+    def test_delta_fingerprints(self):
+        project_keys, plans = make_plans(2, 3)
+        projects = [{'key': key, 'name': key} for key in project_keys]
+        get_state('delta.example.com').model_fingerprints = None
+        self.assertIsNone(self.plugin.model_delta('delta.example.com', projects, plans, log))
+        # Fingerprints don't depend on the process, they are saved in the snapshot
+        fingerprints = get_state('delta.example.com').model_fingerprints
+        self.assertEqual(fingerprints['projects']['PRJ0'], hashlib.sha1('PRJ0\0PRJ0\0').hexdigest())
+
+        plans[0]['name'] = 'Renamed'
+        maps = self.plugin.model_delta('delta.example.com', projects, plans, log)
+        self.assertEqual([om.plan_key for om in maps], ['PRJ0-PLAN0'])
+        self.assertFalse(maps[0]._add)
+
+    def test_servers(self):
+        class Device(object):
+            id = 'servers.example.com'
+            zBambooPort = 443
+            zBambooServerAlias = 'bamboo.example.com'
+            zBambooServerAliases = ['ci.example.com:8085', 'ci.example.com:80a', 'bamboo', 'bamboo.example.com']
+        servers = self.plugin.servers(Device(), log)
+        # The typo and the entry named like the default server are skipped, the duplicate is dropped
+        self.assertEqual(servers, [('bamboo', 'bamboo.example.com', 443),
+                                   ('ci.example.com_8085', 'ci.example.com', 8085)])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestModelPlans))
+    return suite
@@ -0,0 +1,124 @@
+import re
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from twisted.internet.defer import succeed
+
+from ZenPacks.community.Bamboo.dsplugins.BambooProject import BambooProject
+from ZenPacks.community.Bamboo.lib import client
+from ZenPacks.community.Bamboo.lib.client import BambooClient
+
+SERVER = ('cycles.example.com', 443, 'admin', 'admin')
+PLAN_RESULTS = re.compile(r'^/result/(?P<plan_key>[^?]+)\?.*max-result=(?P<count>\d+)')
+
+
+class Config(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeClient(BambooClient):
+    """
+    Bamboo server whose plans completed the builds in self.builds, plan_key -> build numbers. Like the real one, its
+    /result listing only holds the latest build of each plan.
+    """
+
+    def __init__(self, *args):
+        BambooClient.__init__(self, *args)
+        self.builds = {}
+        # Plans whose results were read back, in order
+        self.read_back = []
+
+    def result(self, plan_key, number):
+        # The duration in seconds is the build number, to tell which builds are reported
+        return {'plan': {'key': plan_key}, 'buildNumber': number, 'buildState': 'Successful',
+                'lifeCycleState': 'Finished', 'buildDuration': number * 1000,
+                'buildCompletedTime': '2019-03-05T10:20:00.000+01:00'}
+
+    def get_paged(self, path, item, page_size, semaphore=None, fields=None, keep=None):
+        return succeed([self.result(plan_key, numbers[-1]) for plan_key, numbers in self.builds.items()])
+
+    def get_listing(self, path, item, fields=None, keep=None):
+        match = PLAN_RESULTS.match(path)
+        plan_key = match.group('plan_key')
+        self.read_back.append(plan_key)
+        numbers = self.builds[plan_key][-int(match.group('count')):]
+        return succeed({'results': {'result': [self.result(plan_key, n) for n in reversed(numbers)]}})
+
+
+class TestProjectCycles(BaseTestCase):
+    """
+    Drive collect and onSuccess of BambooProject over several cycles, against a fake Bamboo server.
+    """
+
+    def afterSetUp(self):
+        self.client = client._clients[SERVER] = FakeClient(*SERVER)
+        self.plugin = BambooProject()
+
+    def beforeTearDown(self):
+        client._clients.pop(SERVER, None)
+
+    def make_config(self, device_id, plan_keys):
+        properties = dict(
+            zBambooServerAlias=SERVER[0], zBambooPort=SERVER[1], zBambooUsername=SERVER[2],
+            zBambooPassword=SERVER[3], zBambooRequestTimeout=30, zBambooPageSize=25, zBambooMaxConcurrentRequests=4,
+            zBambooWebhookPort=0, zBambooWebhookPollInterval=3600, zBambooAdaptivePolling=False,
+            zBambooRateLimit=0, zBambooBreakerThreshold=5, zBambooBreakerCooldown=300, zBambooSnapshotMaxSize=0,
+            zBambooPhaseSpread=0, zBambooAnomalyZScore=0)
+        datasources = [Config(datasource='bamboo_build_plan', component=plan_key, cycletime=300,
+                              params={'project_key': 'PRJ', 'plan_key': plan_key}, **properties)
+                       for plan_key in plan_keys]
+        return Config(id=device_id, datasources=datasources)
+
+    def cycle(self, config):
+        """
+        Run a cycle and return the build numbers reported for each plan.
+        """
+        results = []
+        self.plugin.collect(config).addCallback(results.append)
+        data = self.plugin.onSuccess(results[0], config)
+        reported = {}
+        for component, values in data['values'].items():
+            if 'bamboo_build_plan_duration' in values:
+                reported[component] = [int(duration) for duration, _ in values['bamboo_build_plan_duration']]
+        return reported
+
+    def test_reported_once(self):
+        config = self.make_config('cycles1.example.com', ['PRJ-A', 'PRJ-B', 'PRJ-C'])
+        self.client.builds = {'PRJ-A': [1, 2, 3], 'PRJ-B': [1, 2, 3], 'PRJ-C': [1, 2, 3]}
+        # Only the latest build of a plan seen for the first time is reported
+        self.assertEqual(self.cycle(config), {'PRJ-A': [3], 'PRJ-B': [3], 'PRJ-C': [3]})
+
+        # The builds completed between two cycles are read back
+        self.client.builds['PRJ-A'].extend([4, 5, 6])
+        self.client.builds['PRJ-B'].append(4)
+        self.assertEqual(self.cycle(config), {'PRJ-A': [4, 5, 6], 'PRJ-B': [4]})
+        self.assertEqual(self.client.read_back, ['PRJ-A'])
+
+        self.assertEqual(self.cycle(config), {})
+
+    def test_backfill_capped(self):
+        self.plugin.max_backfill = 2
+        plan_keys = ['PRJ-{}'.format(n) for n in range(5)]
+        config = self.make_config('cycles2.example.com', plan_keys)
+        self.client.builds = dict((plan_key, [1]) for plan_key in plan_keys)
+        self.cycle(config)
+
+        for plan_key in plan_keys:
+            self.client.builds[plan_key].extend([2, 3, 4])
+        reported = {}
+        for _ in range(4):
+            del self.client.read_back[:]
+            for plan_key, numbers in self.cycle(config).items():
+                reported.setdefault(plan_key, []).extend(numbers)
+            self.assertLessEqual(len(self.client.read_back), 2)
+        # Every plan was read back once, and each of its builds reported once
+        self.assertEqual(reported, dict((plan_key, [2, 3, 4]) for plan_key in plan_keys))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestProjectCycles))
+    return suite
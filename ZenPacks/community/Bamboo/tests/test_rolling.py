@@ -0,0 +1,60 @@
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.lib import rolling
+from ZenPacks.community.Bamboo.lib.rolling import RollingDurations
+
+
+class TestRollingDurations(BaseTestCase):
+
+    def test_zscore(self):
+        durations = RollingDurations(window=20, min_samples=10)
+        results = durations.update({'PRJ-BUILD': [100.0, 110.0] * 5})
+        # Not enough durations before this update
+        self.assertEqual(results['PRJ-BUILD'][0], None)
+
+        zscore, ewma, mean, stddev = durations.update({'PRJ-BUILD': [135.0]})['PRJ-BUILD']
+        self.assertAlmostEqual(mean, 105.0)
+        self.assertAlmostEqual(stddev, 5.0)
+        self.assertAlmostEqual(zscore, 6.0)
+        self.assertTrue(110.0 < ewma < 135.0)
+
+    def test_ring_buffer(self):
+        durations = RollingDurations(window=10, min_samples=10)
+        durations.update({'PRJ-BUILD': [1000.0] * 10})
+        # The slow builds are pushed out of the window
+        durations.update({'PRJ-BUILD': [100.0, 110.0] * 5})
+        zscore, _, mean, _ = durations.update({'PRJ-BUILD': [105.0]})['PRJ-BUILD']
+        self.assertAlmostEqual(mean, 105.0)
+        self.assertAlmostEqual(zscore, 0.0)
+
+    def test_constant(self):
+        durations = RollingDurations(window=10, min_samples=10)
+        durations.update({'PRJ-BUILD': [300.0] * 10})
+        self.assertEqual(durations.update({'PRJ-BUILD': [300.0]})['PRJ-BUILD'][0], None)
+
+    def test_without_numpy(self):
+        samples = dict(('PRJ-PLAN{}'.format(n), [float(60 + (n * k) % 37) for k in range(15)]) for n in range(50))
+        latest = dict((key, [values[0] * 2]) for key, values in samples.items())
+        vectorized = RollingDurations()
+        vectorized.update(samples)
+        numpy = rolling.numpy
+        rolling.numpy = None
+        try:
+            looped = RollingDurations()
+            looped.update(samples)
+            expected = looped.update(latest)
+        finally:
+            rolling.numpy = numpy
+        for key, result in vectorized.update(latest).items():
+            for value, expected_value in zip(result, expected[key]):
+                if expected_value is None:
+                    self.assertEqual(value, None)
+                else:
+                    self.assertAlmostEqual(value, expected_value)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestRollingDurations))
+    return suite
@@ -0,0 +1,47 @@
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.lib.scheduler import AdaptiveInterval, phase_offset
+
+
+class TestAdaptiveInterval(BaseTestCase):
+
+    def test_backoff(self):
+        schedule = AdaptiveInterval(60, 300)
+        schedule.update(False, 1000)
+        self.assertEqual(schedule.interval, 120)
+        self.assertFalse(schedule.due(1100))
+        self.assertTrue(schedule.due(1120))
+        schedule.update(False, 1120)
+        schedule.update(False, 1360)
+        self.assertEqual(schedule.interval, 300)
+        schedule.update(True, 1660)
+        self.assertEqual(schedule.interval, 60)
+
+    def test_wake(self):
+        schedule = AdaptiveInterval(60, 300)
+        schedule.update(False, 1000)
+        schedule.wake()
+        self.assertTrue(schedule.due(1001))
+
+
+class TestPhaseOffset(BaseTestCase):
+
+    def test_deterministic(self):
+        key = ('bamboo.example.com', 300, 'bambooResults', 'bamboo')
+        self.assertEqual(phase_offset(key, 300), phase_offset(key, 300))
+
+    def test_spread(self):
+        offsets = [phase_offset(('device{}'.format(n), 300, 'bambooResults', 'bamboo'), 300) for n in range(100)]
+        self.assertTrue(all(0 <= offset < 150 for offset in offsets))
+        # Spread over the first half of the cycle, not bunched together
+        self.assertTrue(min(offsets) < 30)
+        self.assertTrue(max(offsets) > 120)
+        self.assertEqual(phase_offset(('device', 300, 'bambooResults', 'bamboo'), 300, 0), 0)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestAdaptiveInterval))
+    suite.addTest(makeSuite(TestPhaseOffset))
+    return suite
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.community.Bamboo.lib import snapshot
+from ZenPacks.community.Bamboo.lib.cache import CacheEntry, ResponseCache
+from ZenPacks.community.Bamboo.lib.snapshot import restore_snapshot, save_snapshot, snapshot_path
+from ZenPacks.community.Bamboo.lib.state import DeviceState
+
+
+class Client(object):
+
+    def __init__(self):
+        self.cache = ResponseCache()
+
+
+class TestSnapshot(BaseTestCase):
+
+    def afterSetUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def beforeTearDown(self):
+        shutil.rmtree(self.directory)
+
+    def saved_state(self):
+        state = DeviceState('bamboo.example.com')
+        state.high_water = {'PRJ-BUILD': 42, 'PRJ-TEST': 7}
+        state.model_fingerprints = {'projects': {'PRJ': 1}, 'plans': {'PRJ-BUILD': (2, 'PRJ')}}
+        state.dirty = True
+        client = Client()
+        client.cache.put(('/plan', ('', 'SANDBOX', True, None)), CacheEntry({'plans': {}}, etag='"abc"', expires=1))
+        save_snapshot(state, client, 'zenpython', 1024, self.directory, now=1000)
+        return state, client
+
+    def test_round_trip(self):
+        self.saved_state()
+        state = DeviceState('bamboo.example.com')
+        client = Client()
+        restore_snapshot(state, client, 'zenpython', 1024, self.directory)
+        self.assertEqual(state.high_water, {'PRJ-BUILD': 42, 'PRJ-TEST': 7})
+        self.assertEqual(state.model_fingerprints['plans']['PRJ-BUILD'], (2, 'PRJ'))
+        entry = client.cache.get(('/plan', ('', 'SANDBOX', True, None)))
+        self.assertEqual(entry.etag, '"abc"')
+        self.assertEqual(entry.data, {'plans': {}})
+
+    def test_unchanged_not_written(self):
+        state, client = self.saved_state()
+        path = snapshot_path(state, 'zenpython', self.directory)
+        os.remove(path)
+        save_snapshot(state, client, 'zenpython', 1024, self.directory, now=2000)
+        self.assertFalse(os.path.exists(path))
+        # The times of the last poll and notification change every cycle, they don't make a snapshot differ
+        state.last_poll = 2000
+        state.dirty = True
+        save_snapshot(state, client, 'zenpython', 1024, self.directory, now=2000)
+        self.assertFalse(os.path.exists(path))
+        state.high_water['PRJ-BUILD'] = 43
+        state.dirty = True
+        save_snapshot(state, client, 'zenpython', 1024, self.directory, now=2000)
+        self.assertTrue(os.path.exists(path))
+        # No temporary file left behind
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_interval(self):
+        state, client = self.saved_state()
+        path = snapshot_path(state, 'zenpython', self.directory)
+        os.remove(path)
+        state.high_water['PRJ-BUILD'] = 43
+        state.dirty = True
+        save_snapshot(state, client, 'zenpython', 1024, self.directory, interval=300, now=1200)
+        self.assertFalse(os.path.exists(path))
+        save_snapshot(state, client, 'zenpython', 1024, self.directory, interval=300, now=1300)
+        self.assertTrue(os.path.exists(path))
+        # A response added to the cache is saved as well
+        os.remove(path)
+        client.cache.put('/info', CacheEntry({'version': '6.8.0'}, digest='def'))
+        save_snapshot(state, client, 'zenpython', 1024, self.directory, interval=300, now=1600)
+        self.assertTrue(os.path.exists(path))
+
+    def test_version(self):
+        self.saved_state()
+        version = snapshot.SNAPSHOT_VERSION
+        snapshot.SNAPSHOT_VERSION = version + 1
+        try:
+            state = DeviceState('bamboo.example.com')
+            restore_snapshot(state, Client(), 'zenpython', 1024, self.directory)
+        finally:
+            snapshot.SNAPSHOT_VERSION = version
+        self.assertEqual(state.high_water, {})
+
+    def test_size_limit(self):
+        state = DeviceState('bamboo.example.com')
+        state.high_water = dict(('PRJ-PLAN{}'.format(n), n) for n in range(200))
+        client = Client()
+        client.cache.put('/plan', CacheEntry({'plans': {'plan': ['x' * 100] * 100}}))
+        state.dirty = True
+        save_snapshot(state, client, 'zenpython', 4, self.directory)
+        # Saved without the cached responses
+        restored = DeviceState('bamboo.example.com')
+        restored_client = Client()
+        restore_snapshot(restored, restored_client, 'zenpython', 4, self.directory)
+        self.assertEqual(len(restored.high_water), 200)
+        self.assertEqual(len(restored_client.cache), 0)
+        # Larger than the limit, ignored
+        restored = DeviceState('bamboo.example.com')
+        restore_snapshot(restored, Client(), 'zenpython', 1, self.directory)
+        self.assertEqual(restored.high_water, {})
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestSnapshot))
+    return suite
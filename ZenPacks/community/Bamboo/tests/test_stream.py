@@ -0,0 +1,73 @@
+import json
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from twisted.internet.defer import CancelledError
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone, ResponseFailed
+
+from ZenPacks.community.Bamboo.lib.stream import read_items
+
+DOCUMENT = json.dumps({'results': {'size': 2, 'result': [{'buildNumber': 1}, {'buildNumber': 2}]}})
+# Up to the end of the first entry
+HALF = DOCUMENT.index('}, {') + 1
+
+
+class FakeTransport(object):
+    """
+    Transport of a response body, which like the one of twisted.web.client can only be stopped.
+    """
+
+    def __init__(self):
+        self.stopped = False
+
+    def stopProducing(self):
+        self.stopped = True
+
+
+class FakeResponse(object):
+
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.protocol = None
+
+    def deliverBody(self, protocol):
+        self.protocol = protocol
+        protocol.makeConnection(self.transport)
+
+
+class TestReadItems(BaseTestCase):
+
+    def read(self, response):
+        results = []
+        d = read_items(response, ('results', 'result'))
+        d.addBoth(results.append)
+        return d, results
+
+    def test_complete(self):
+        response = FakeResponse()
+        d, results = self.read(response)
+        response.protocol.dataReceived(DOCUMENT)
+        response.protocol.connectionLost(Failure(ResponseDone()))
+        self.assertEqual(results[0].items, [{'buildNumber': 1}, {'buildNumber': 2}])
+        self.assertFalse(response.transport.stopped)
+
+    def test_cancel_half_delivered(self):
+        response = FakeResponse()
+        d, results = self.read(response)
+        response.protocol.dataReceived(DOCUMENT[:HALF])
+        d.cancel()
+        self.assertTrue(response.transport.stopped)
+        self.assertTrue(results[0].check(CancelledError))
+        # The rest of the body isn't parsed, and the connection lost doesn't fire the Deferred again
+        response.protocol.dataReceived(DOCUMENT[HALF:])
+        response.protocol.connectionLost(Failure(ResponseFailed([])))
+        self.assertEqual(response.protocol.parser.items, [{'buildNumber': 1}])
+        self.assertEqual(len(results), 1)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestReadItems))
+    return suite
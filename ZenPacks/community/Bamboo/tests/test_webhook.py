@@ -0,0 +1,131 @@
+import json
+import os
+from StringIO import StringIO
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.trial import unittest
+from twisted.web.client import Agent, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+from twisted.web.server import Site
+
+from ZenPacks.community.Bamboo.lib.state import get_state
+from ZenPacks.community.Bamboo.lib.webhook import WebhookResource, parse_notification
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+PAYLOADS = ('webhook_build_successful.json', 'webhook_build_failed.json')
+
+
+def load_payload(name):
+    with open(os.path.join(DATA_DIR, name)) as f:
+        return f.read()
+
+
+class TestParseNotification(unittest.TestCase):
+
+    def test_webhook_payload(self):
+        build = parse_notification(json.loads(load_payload('webhook_build_successful.json')))
+        self.assertEqual(build['plan']['key'], 'PRJ-PLAN')
+        self.assertEqual(build['buildNumber'], 42)
+        self.assertEqual(build['buildState'], 'Successful')
+        self.assertEqual(build['buildDuration'], 160000)
+
+    def test_result_entry(self):
+        build = parse_notification({'plan': {'key': 'PRJ-PLAN'}, 'buildNumber': 7, 'buildState': 'Failed',
+                                    'buildDuration': 1234, 'buildCompletedTime': '2019-03-05T10:20:00.000+01:00'})
+        self.assertEqual(build['buildNumber'], 7)
+        self.assertEqual(build['buildState'], 'Failed')
+        self.assertEqual(build['buildDuration'], 1234)
+
+    def test_not_a_build(self):
+        self.assertIsNone(parse_notification({'notification': {'event': 'DEPLOYMENT_STARTED'}}))
+        self.assertIsNone(parse_notification([]))
+
+
+class TestWebhookResource(unittest.TestCase):
+    """
+    Replay recorded notifications against a local listener.
+    """
+
+    device_id = 'bamboo.test'
+
+    def setUp(self):
+        self.listener = reactor.listenTCP(0, Site(WebhookResource()), interface='127.0.0.1')
+        self.agent = Agent(reactor)
+        state = get_state(self.device_id)
+        state.pop_webhook_builds()
+        state.high_water['PRJ-PLAN'] = 41
+        state.webhook_token = ''
+
+    def tearDown(self):
+        return self.listener.stopListening()
+
+    @inlineCallbacks
+    def post(self, path, body, headers=None):
+        url = 'http://127.0.0.1:{}{}'.format(self.listener.getHost().port, path)
+        response = yield self.agent.request('POST', url, Headers(headers or {}),
+                                            bodyProducer=FileBodyProducer(StringIO(body)))
+        yield readBody(response)
+        returnValue(response.code)
+
+    @inlineCallbacks
+    def test_replay(self):
+        for name in PAYLOADS:
+            code = yield self.post('/bamboo/{}'.format(self.device_id), load_payload(name))
+            self.assertEqual(code, 202)
+
+        state = get_state(self.device_id)
+        self.assertTrue(state.last_webhook)
+        builds = state.pop_webhook_builds()
+        self.assertEqual([b['buildNumber'] for b in builds], [42, 43])
+        self.assertEqual([b['buildState'] for b in builds], ['Successful', 'Failed'])
+
+    @inlineCallbacks
+    def test_bad_requests(self):
+        code = yield self.post('/other', load_payload(PAYLOADS[0]))
+        self.assertEqual(code, 404)
+        code = yield self.post('/bamboo/{}'.format(self.device_id), 'not json')
+        self.assertEqual(code, 400)
+        self.assertEqual(get_state(self.device_id).pop_webhook_builds(), [])
+        code = yield self.post('/bamboo/unknown.device', load_payload(PAYLOADS[0]))
+        self.assertEqual(code, 404)
+
+    @inlineCallbacks
+    def test_malformed_payload(self):
+        path = '/bamboo/{}'.format(self.device_id)
+        for build in ({'plan': {'key': 'PRJ-PLAN'}, 'buildNumber': 'x42', 'buildState': 'Successful'},
+                      {'plan': {'key': 'PRJ-PLAN'}, 'buildNumber': 42, 'buildState': ['Successful']},
+                      {'plan': {'key': ['PRJ-PLAN']}, 'buildNumber': 42, 'buildState': 'Successful'},
+                      {'plan': 'PRJ-PLAN', 'buildNumber': 42, 'buildState': 'Successful'},
+                      {'plan': {'key': 'PRJ-PLAN'}, 'buildNumber': 42, 'buildState': 'Successful',
+                       'buildDuration': 'long'}):
+            code = yield self.post(path, json.dumps(build))
+            self.assertEqual(code, 400)
+        self.assertEqual(get_state(self.device_id).pop_webhook_builds(), [])
+
+    @inlineCallbacks
+    def test_token(self):
+        get_state(self.device_id).webhook_token = 'secret'
+        path = '/bamboo/{}'.format(self.device_id)
+        code = yield self.post(path, load_payload(PAYLOADS[0]))
+        self.assertEqual(code, 403)
+        code = yield self.post(path, load_payload(PAYLOADS[0]), {'X-Bamboo-Token': ['wrong']})
+        self.assertEqual(code, 403)
+        code = yield self.post(path, load_payload(PAYLOADS[0]), {'X-Bamboo-Token': ['secret']})
+        self.assertEqual(code, 202)
+        code = yield self.post(path + '?token=secret', load_payload(PAYLOADS[1]))
+        self.assertEqual(code, 202)
+        self.assertEqual(len(get_state(self.device_id).pop_webhook_builds()), 2)
+
+    @inlineCallbacks
+    def test_implausible_build_number(self):
+        payload = json.dumps({'plan': {'key': 'PRJ-PLAN'}, 'buildNumber': 999999, 'buildState': 'Successful',
+                              'buildDuration': 1000})
+        code = yield self.post('/bamboo/{}'.format(self.device_id), payload)
+        self.assertEqual(code, 400)
+        # Plans without a high-water mark are left to the polling
+        payload = json.dumps({'plan': {'key': 'PRJ-OTHER'}, 'buildNumber': 3, 'buildState': 'Successful',
+                              'buildDuration': 1000})
+        code = yield self.post('/bamboo/{}'.format(self.device_id), payload)
+        self.assertEqual(code, 202)
+        self.assertEqual(get_state(self.device_id).pop_webhook_builds(), [])